@@ -0,0 +1,350 @@
+# memories_benchmark.py
+"""
+Snapchat Memories Benchmark (for development)
+Times the offline stages of both scripts on synthetic exports so performance
+changes can be measured and regressions caught. Nothing here talks to Snapchat.
+
+For each size it generates a realistic memories_history.html (with exact
+duplicates and malformed rows) plus a matching fake library on disk, then
+records the best-of-N time and the tracemalloc peak of each stage:
+    parse_html_and_dedupe, create_manifest, check_existing_files,
+    load_manifest, scan_disk_files, verify_completeness, resolve_duplicates
+
+Each size runs once per --layout (LIBRARY_LAYOUT folders), and with --bundle
+part of each library is packed into bundles (BUNDLE_MODE), which adds the
+scan_bundles stage and the bundled branch of verify_completeness.
+
+Libraries too big to write out (1M files by default) are checked in memory:
+the manifest is real, the file listing is what scan_disk_files() would
+return, and verify_completeness has to stay under VERIFY_TARGET_SECONDS.
+
+Examples:
+    python memories_benchmark.py --rows 1000 10000 100000
+    python memories_benchmark.py --rows 100000 --save bench_baseline.json
+    python memories_benchmark.py --rows 100000 --compare bench_baseline.json
+    python memories_benchmark.py --rows 1000 --listed-rows 1000000
+    python memories_benchmark.py --rows 10000 --layout year hash --bundle
+"""
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+DEFAULT_ROWS = [1000, 10000]
+DEFAULT_LISTED_ROWS = [1000000]  # compared against an in-memory file listing, nothing written
+DEFAULT_LAYOUTS = ["year"]    # LIBRARY_LAYOUT values: "year", "month", "day", "hash"
+VERIFY_TARGET_SECONDS = 1.0   # verify_completeness budget for the listed sizes
+REPEAT = 3                    # timed runs per stage, the fastest counts
+SEED = 1234
+
+# Shape of the synthetic export
+DUPLICATE_ROW_RATE = 0.02     # exact repeats (same timestamp + media_id)
+MALFORMED_ROW_RATE = 0.005    # broken markup or URLs without a media ID
+VIDEO_RATE = 0.3
+GPS_RATE = 0.6
+
+# Shape of the fake library on disk
+PRESENT_RATE = 0.95           # items already downloaded
+DUPLICATE_FILE_RATE = 0.01    # extra _NO-OVERLAY copy next to the real file
+UNEXPECTED_FILE_RATE = 0.005  # files that match nothing in the export
+BUNDLED_RATE = 0.5            # with --bundle: downloaded items stored in a bundle instead of a loose file
+
+# A stage counts as a regression when it is this much slower / bigger than the baseline
+TIME_TOLERANCE = 0.20
+MEMORY_TOLERANCE = 0.20
+TIME_NOISE_FLOOR = 0.01       # seconds; smaller slowdowns are timer noise
+
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import argparse, contextlib, json, os, random, sys, tempfile, time, tracemalloc, uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# The scripts under test (both must sit next to this one)
+import memories_download as md
+import memories_verify_recover as vr
+
+DATA_ROOT = Path(tempfile.gettempdir()) / "memories_benchmark"
+
+
+# ============================================================
+# SYNTHETIC EXPORT + LIBRARY
+# ============================================================
+def generate_rows(n, rng, with_html=True):
+    """n table rows as (timestamp, type, gps, media_id) plus the row HTML (empty strings without with_html)"""
+    start = datetime(2016, 1, 1, tzinfo=timezone.utc)
+    span = int((datetime(2025, 12, 31, tzinfo=timezone.utc) - start).total_seconds())
+    
+    rows, html = [], []
+    for _ in range(n):
+        roll = rng.random()
+        if rows and roll < DUPLICATE_ROW_RATE:
+            # Exact repeat of an earlier row, as Snapchat exports sometimes contain
+            earlier = rng.randrange(len(rows))
+            rows.append(rows[earlier])
+            html.append(html[earlier])
+            continue
+        
+        ts = start + timedelta(seconds=rng.randrange(span))
+        kind = "Video" if rng.random() < VIDEO_RATE else "Image"
+        gps = f"Latitude, Longitude: {rng.uniform(-60, 70):.6f}, {rng.uniform(-180, 180):.6f}" if rng.random() < GPS_RATE else ""
+        media_id = str(uuid.UUID(int=rng.getrandbits(128))).upper()
+        url = (f"https://app.snapchat.com/dmd/memories?uid={uuid.UUID(int=rng.getrandbits(128))}"
+               f"&sid={rng.getrandbits(64):X}&mid={media_id}&ts={int(ts.timestamp() * 1000)}&sig={rng.getrandbits(128):x}")
+        
+        if roll < DUPLICATE_ROW_RATE + MALFORMED_ROW_RATE:
+            # Half are missing a cell (regex never matches), half have no media ID
+            if rng.random() < 0.5:
+                html.append(f"<tr><td>{ts:%Y-%m-%d %H:%M:%S} UTC</td><td>{kind}</td></tr>\n")
+            else:
+                html.append(f"<tr><td>{ts:%Y-%m-%d %H:%M:%S} UTC</td><td>{kind}</td><td>{gps}</td>"
+                            f"<td><a href=\"#\" onclick=\"downloadMemories('{url.replace('&mid=', '&x=')}', this, true); return false;\">Download</a></td></tr>\n")
+            rows.append(None)
+            continue
+        
+        rows.append((ts, kind, gps, media_id))
+        if not with_html:
+            html.append("")
+            continue
+        html.append(f"<tr><td>{ts:%Y-%m-%d %H:%M:%S} UTC</td><td>{kind}</td><td>{gps}</td>"
+                    f"<td><a href=\"#\" onclick=\"downloadMemories('{url}', this, true); return false;\">Download</a></td></tr>\n")
+    
+    return rows, html
+
+def build_dataset(n, layout="year", bundle=False):
+    """Export + library for n rows in one layout, generated once and reused from DATA_ROOT"""
+    base = DATA_ROOT / f"rows_{n}_{layout}{'_bundled' if bundle else ''}_seed_{SEED}"
+    done_marker = base / ".complete"
+    if done_marker.exists():
+        return base
+    
+    print(f"Generating {n} rows and fake library in {base} ...")
+    md.LIBRARY_LAYOUT = layout
+    rng = random.Random(SEED)
+    rows, html = generate_rows(n, rng)
+    
+    base.mkdir(parents=True, exist_ok=True)
+    with open(base / "memories_history.html", "w", encoding="utf-8") as f:
+        f.write("<html><body><table>\n<tr><th>Date</th><th>Media Type</th><th>Location</th><th></th></tr>\n")
+        f.writelines(html)
+        f.write("</table></body></html>\n")
+    
+    made_dirs = set()
+    seen = set()
+    for row in rows:
+        if row is None or row in seen:
+            continue
+        seen.add(row)
+        ts, kind, _, media_id = row
+        if rng.random() >= PRESENT_RATE:
+            continue
+        
+        folder = md.media_subdir(ts, media_id)
+        media_dir = base / folder
+        name = f"{ts:%Y-%m-%d_%H%M%S}_{media_id}"
+        ext = ".mp4" if kind == "Video" else ".jpg"
+        if bundle and rng.random() < BUNDLED_RATE:
+            # Same tar + .idx format the downloader writes (one bundle per year)
+            tar = base / md.BUNDLE_DIR_NAME / f"{ts.year}.tar"
+            md.bundle_writer._append(tar, f"{folder}/{name}{ext}", media_id, [b"x" * rng.randrange(1, 64)], ts.timestamp())
+            continue
+        
+        if media_dir not in made_dirs:
+            media_dir.mkdir(parents=True, exist_ok=True)
+            made_dirs.add(media_dir)
+        
+        (media_dir / f"{name}{ext}").write_bytes(b"x" * rng.randrange(1, 64))
+        if rng.random() < DUPLICATE_FILE_RATE:
+            (media_dir / f"{name}_NO-OVERLAY{ext}").write_bytes(b"x" * rng.randrange(1, 64))
+        if rng.random() < UNEXPECTED_FILE_RATE:
+            (media_dir / f"IMG_{rng.getrandbits(32):08X}.jpg").write_bytes(b"x")
+    
+    done_marker.touch()
+    return base
+
+def build_listing(n, layout="year"):
+    """Manifest for n rows plus the relative paths scan_disk_files() would return, without writing the files"""
+    base = DATA_ROOT / f"listed_{n}_{layout}_seed_{SEED}"
+    (base / "_logs").mkdir(parents=True, exist_ok=True)
+    point_scripts_at(base, layout)
+    
+    print(f"Generating {n} rows and an in-memory file listing ...")
+    rng = random.Random(SEED)
+    rows, _ = generate_rows(n, rng, with_html=False)
+    
+    items, files, seen = [], [], set()
+    for row in rows:
+        if row is None or row in seen:
+            continue
+        seen.add(row)
+        ts, kind, gps, media_id = row
+        items.append(md.MemoryItem("", int(ts.timestamp()), gps, media_id, kind))
+        if rng.random() >= PRESENT_RATE:
+            continue
+        
+        folder = md.media_subdir(ts, media_id)
+        name = f"{folder}/{ts:%Y-%m-%d_%H%M%S}_{media_id}"
+        ext = ".mp4" if kind == "Video" else ".jpg"
+        files.append(f"{name}{ext}")
+        if rng.random() < DUPLICATE_FILE_RATE:
+            files.append(f"{name}_NO-OVERLAY{ext}")
+        if rng.random() < UNEXPECTED_FILE_RATE:
+            files.append(f"{folder}/IMG_{rng.getrandbits(32):08X}.jpg")
+    
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        md.create_manifest(items)
+    return files
+
+def point_scripts_at(base, layout="year"):
+    """Aim both scripts' path and layout settings at a benchmark dataset"""
+    md.activate_export(base)
+    md.S3_BUCKET = None
+    md.LIBRARY_LAYOUT = layout
+    
+    vr.BASE_DIR = base
+    vr.TEMP_DIR = base / "_temp"
+    vr.LOG_DIR = base / "_logs"
+    vr.MANIFEST_CSV = md.MANIFEST_CSV
+    vr.MANIFEST_BIN = md.MANIFEST_BIN
+    vr.DUPLICATES_CSV = vr.LOG_DIR / vr.DUPLICATES_CSV.name
+    vr.LOG_DIR.mkdir(exist_ok=True)
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+def measure(fn, *args):
+    """(best wall seconds over REPEAT runs, tracemalloc peak bytes, result); console output is discarded"""
+    best = float("inf")
+    for _ in range(REPEAT):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            result = fn(*args)
+            best = min(best, time.perf_counter() - started)
+    
+    # Peak memory in a separate run, since tracing slows everything down
+    tracemalloc.start()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    return best, peak, result
+
+def run_suite(n, layout="year", bundle=False):
+    """Time every stage on an n-row dataset, in pipeline order"""
+    base = build_dataset(n, layout, bundle)
+    point_scripts_at(base, layout)
+    results = {}
+    
+    def record(stage, fn, *args):
+        seconds, peak, result = measure(fn, *args)
+        results[stage] = {"seconds": seconds, "peak_bytes": peak}
+        print(f"  {stage:<24} {seconds * 1000:>10.1f} ms  {peak / 1024 / 1024:>8.1f} MB peak  "
+              f"{n / seconds if seconds else 0:>12,.0f} rows/s")
+        return result
+    
+    print(f"\n{n} rows, {layout} layout{', bundled' if bundle else ''} ({base})")
+    items = record("parse_html_and_dedupe", md.parse_html_and_dedupe, md.HTML_FILE)
+    record("create_manifest", md.create_manifest, items)
+    record("check_existing_files", md.check_existing_files, items)
+    manifest_items = record("load_manifest", vr.load_manifest)
+    actual_files = record("scan_disk_files", vr.scan_disk_files)
+    bundled = record("scan_bundles", vr.scan_bundles) if bundle else None
+    verification = record("verify_completeness", vr.verify_completeness, manifest_items, actual_files, bundled)
+    record("resolve_duplicates", vr.resolve_duplicates, verification["duplicates"], False)
+    
+    return results
+
+def run_listed(n, layout="year"):
+    """Time the manifest/listing comparison on n rows without a library on disk"""
+    files = build_listing(n, layout)
+    results = {}
+    
+    def record(stage, fn, *args):
+        seconds, peak, result = measure(fn, *args)
+        results[stage] = {"seconds": seconds, "peak_bytes": peak}
+        print(f"  {stage:<24} {seconds * 1000:>10.1f} ms  {peak / 1024 / 1024:>8.1f} MB peak")
+        return result
+    
+    print(f"\n{n} rows, {layout} layout, {len(files)} listed files (in memory)")
+    manifest_items = record("load_manifest", vr.load_manifest)
+    record("verify_completeness", vr.verify_completeness, manifest_items, files)
+    
+    seconds = results["verify_completeness"]["seconds"]
+    if seconds <= VERIFY_TARGET_SECONDS:
+        print(f"  ✓ verify_completeness within its {VERIFY_TARGET_SECONDS:.1f} s budget")
+    else:
+        print(f"  ✗ verify_completeness over its {VERIFY_TARGET_SECONDS:.1f} s budget ({seconds:.2f} s)")
+    return results
+
+# ============================================================
+# BASELINE COMPARISON
+# ============================================================
+def compare(results, baseline):
+    """Stages slower or hungrier than the baseline beyond the tolerances"""
+    regressions = []
+    for rows, stages in results.items():
+        for stage, now in stages.items():
+            before = baseline.get(rows, {}).get(stage)
+            if not before:
+                continue
+            if now["seconds"] > before["seconds"] * (1 + TIME_TOLERANCE) + TIME_NOISE_FLOOR:
+                regressions.append(f"{rows} rows {stage}: {before['seconds'] * 1000:.1f} -> {now['seconds'] * 1000:.1f} ms")
+            if now["peak_bytes"] > before["peak_bytes"] * (1 + MEMORY_TOLERANCE):
+                regressions.append(f"{rows} rows {stage}: {before['peak_bytes'] / 1024 / 1024:.1f} -> "
+                                   f"{now['peak_bytes'] / 1024 / 1024:.1f} MB peak")
+    return regressions
+
+# ============================================================
+# MAIN
+# ============================================================
+def main():
+    global REPEAT
+    
+    parser = argparse.ArgumentParser(description="Benchmark the offline parse/verify stages on synthetic exports")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="export sizes to test (1k to 1M)")
+    parser.add_argument("--listed-rows", type=int, nargs="*", default=DEFAULT_LISTED_ROWS,
+                        help="sizes whose library is only listed in memory, to time verify_completeness at scale")
+    parser.add_argument("--layout", nargs="+", default=DEFAULT_LAYOUTS, choices=["year", "month", "day", "hash"],
+                        help="LIBRARY_LAYOUT folders to build each library in")
+    parser.add_argument("--bundle", action="store_true", help="also run each size with part of the library in bundles")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per stage")
+    parser.add_argument("--save", help="write results to this JSON file (e.g. a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to check for regressions; exits 1 if any")
+    args = parser.parse_args()
+    REPEAT = args.repeat
+    
+    print("=" * 60)
+    print("SNAPCHAT MEMORIES BENCHMARK")
+    print("=" * 60)
+    
+    # Keys stay "<rows>" for the default year layout, so older baselines still compare
+    results = {}
+    for layout in args.layout:
+        suffix = "" if layout == "year" else f" {layout}"
+        for n in args.rows:
+            results[f"{n}{suffix}"] = run_suite(n, layout)
+            if args.bundle:
+                results[f"{n}{suffix} bundled"] = run_suite(n, layout, bundle=True)
+        results.update({f"{n}{suffix} listed": run_listed(n, layout) for n in args.listed_rows})
+    
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved: {args.save}")
+    
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print(f"\n✗ {len(regressions)} regressions against {args.compare}:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print(f"\n✓ No regressions against {args.compare}")
+
+if __name__ == "__main__":
+    main()
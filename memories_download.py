@@ -31,25 +31,150 @@ LOG_DIR = BASE_DIR / "_logs"
 # Memories History HTML file
 HTML_FILE = BASE_DIR / "memories_history.html"
 
+# Folders inside BASE_DIR: "year" = <year>/, "month" = <year>/<MM>/, "day" = <year>/<MM>/<DD>/,
+# "hash" = <year>/<2 hex chars>/ (256 evenly filled folders per year). Busy years can hold
+# 20k+ files, which makes one flat folder slow to list, especially on a NAS.
+# To change it for an existing library run: python memories_migrate_layout.py
+LIBRARY_LAYOUT = "year"
+
 MAX_CONCURRENT = 4
 MAX_RETRIES = 3
 TIMEOUT = 30
 RETRY_BACKOFF = [2, 5, 10]  # seconds between retries
 
+# The download links in memories_history.html are signed and stop working a while after the
+# export is made. Links that carry their own expiry (X-Amz-Expires, Expires=, se=, ...) are
+# skipped once it has passed. The rest are assumed to work for EXPORT_LINK_LIFETIME_HOURS after
+# the export was created (the HTML file's date, or EXPORT_CREATED_AT if that is wrong); that
+# guess only orders the queue (soonest-expiring first) and drives the too-slow warning, so a
+# link without its own expiry is always tried. None = only explicit expiries.
+EXPIRY_SCHEDULING = True
+EXPORT_LINK_LIFETIME_HOURS = 3 * 24
+EXPORT_CREATED_AT = None       # e.g. "2024-05-01 09:30" (UTC)
+EXPIRY_MARGIN_SECONDS = 60     # don't start or retry a download this close to its link's expiry
+EXPIRY_CHECK_SECONDS = 60      # how often the pace is compared with the remaining links' expiry
+
+# Cap on bytes held in memory by in-flight downloads, ZIP handling and merging.
+# Workers wait for room instead of piling large videos into RAM at once.
+MEMORY_BUDGET_MB = 512
+UNKNOWN_SIZE_ESTIMATE_MB = 32  # reserved when the server sends no Content-Length
+ZIP_MEMORY_FACTOR = 2          # ZIP bytes plus the extracted main file read back
+
+# Progress display: bytes and items are counted by every worker, the bars redraw on a timer
+PROGRESS_REFRESH_SECONDS = 0.5
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+SNIFF_BYTES = 64  # first bytes checked for JPEG/PNG/MP4/ZIP signatures before the rest is read
+
+# Bandwidth limit in MB/s shared by all download workers (and the verify script's retries),
+# None = unlimited. BANDWIDTH_SCHEDULE overrides it by local time of day with
+# ("HH:MM", "HH:MM", MB/s) windows, e.g. [("08:00", "18:00", 2)] to stay at 2 MB/s during
+# office hours and run at full speed otherwise (None in a window = unlimited; windows may
+# wrap past midnight). To change limits while running, write BANDWIDTH_FILE (next to your
+# memories_history.html) as {"limit_mb_s": 5, "schedule": [["08:00", "18:00", 2]]};
+# it is re-read every few seconds, and deleting it goes back to these settings.
+BANDWIDTH_LIMIT_MBPS = None
+BANDWIDTH_SCHEDULE = []
+BANDWIDTH_FILE = BASE_DIR / "bandwidth.json"
+
+# Hedged requests: when a transfer runs slower than the HEDGE_PERCENTILE throughput of earlier
+# transfers (e.g. a slow CDN edge), race a second request for it and keep whichever finishes first
+HEDGE_REQUESTS = False
+HEDGE_PERCENTILE = 10        # hedge transfers slower than the slowest 10% seen so far
+HEDGE_MIN_SECONDS = 2.0      # never hedge a transfer that started less than this ago
+HEDGE_MIN_SAMPLES = 20       # finished transfers needed before hedging starts
+HEDGE_MAX_EXTRA_PERCENT = 5  # hedges may add at most this much to the bytes downloaded
+HEDGE_MAX_IN_FLIGHT = 2
+
+# Disk writer: bounded thread pool, preallocation and fsync policy
+WRITER_THREADS = 4
+PREALLOCATE_FILES = True      # posix_fallocate the full size before writing (Linux)
+FSYNC_POLICY = "batch"        # "file" = fsync every file, "batch" = every FSYNC_BATCH_SIZE files, "none"
+FSYNC_BATCH_SIZE = 64
+
+# Bundles: pack small items into uncompressed tar files instead of thousands of loose
+# files (kinder to inodes, backups and NAS listings). None = normal files, "year" or
+# "month" = one _bundles/<period>.tar per year or month, each with a .idx offset index.
+BUNDLE_MODE = None
+BUNDLE_MAX_ITEM_MB = 16  # bigger items stay loose files in <year>/
+
+# Object storage: upload media straight to an S3-compatible bucket (AWS S3, MinIO, Backblaze B2,
+# Wasabi, ...) instead of writing it under BASE_DIR. Needs `pip install boto3`; credentials come
+# from the usual AWS environment variables or ~/.aws files. Objects are stored as
+# <S3_PREFIX><export folder name>/<year>/<file>; _logs stay local. Takes precedence over BUNDLE_MODE.
+S3_BUCKET = None
+S3_PREFIX = ""
+S3_ENDPOINT_URL = None     # e.g. "http://localhost:9000" for MinIO, None = AWS
+S3_PART_SIZE_MB = 8        # multipart chunk size; files below this go up in one request
+S3_UPLOAD_THREADS = 4      # parallel part uploads per file
+
+# Long overlay videos are split at keyframes, the segments get the overlay in parallel FFmpeg
+# processes, and the results are joined with a stream copy. If the joined video's length doesn't
+# match the original, it is merged again in one pass.
+SEGMENT_PARALLEL_MERGE = True
+SEGMENT_MIN_SECONDS = 30   # shorter videos are merged in one pass
+SEGMENT_SECONDS = 10       # target segment length (cuts land on the next keyframe)
+SEGMENT_WORKERS = None     # encodes running at once across all videos, None = one per CPU core
+
+# Many overlays are blank or almost fully transparent. Those are detected from the PNG's alpha
+# channel and the main file is saved as is (no FFmpeg, no re-encode, no quality loss).
+SKIP_BLANK_OVERLAYS = True
+BLANK_OVERLAY_MAX_ALPHA = 2  # 0-255; pixels this transparent or more count as invisible
+
+# Thumbnails for galleries (also: python memories_thumbnails.py for an existing library)
+THUMBNAILS = False
+THUMB_DIR_NAME = "_thumbs"        # inside BASE_DIR; mirrors <year>/ folders, one .jpg per memory
+THUMB_SIZE = 320                  # longest side in pixels
+THUMB_WORKERS = None             # process pool size, None = one per CPU core
+
+# Profiling: run `python memories_download.py --profile` (or set True) to record event-loop
+# lag, blocking steps, per-stage wall vs CPU time and memory peaks into _logs/
+PROFILE = False
+PROFILE_BLOCKING_THRESHOLD = 0.1  # seconds a single step may hold the event loop
+PROFILE_LAG_INTERVAL = 0.05       # how often event-loop lag is sampled
+
+# Write capture time and GPS into each file (EXIF for JPEGs, mvhd/©xyz for MP4s)
+EMBED_METADATA = True
+
+# Put the MP4 index (moov) before the media data so videos start playing while still
+# streaming. Done in memory for downloads and via -movflags +faststart for FFmpeg merges;
+# python memories_faststart.py fixes videos already in the library.
+FASTSTART = True
+
+# Batch mode: several exports (e.g. one per account) in one run, sharing one connection
+# pool and MAX_CONCURRENT workers that take turns between exports. Each folder needs its
+# own memories_history.html and gets its own media, _logs and summary. Either list the
+# folders here or run: python memories_download.py --batch /path/alice /path/bob
+BATCH_EXPORT_DIRS = []
+
 # Log files
 MANIFEST_CSV = LOG_DIR / "manifest.csv"
+MANIFEST_BIN = LOG_DIR / "manifest.bin"  # same rows in columns, memory-mapped by memories_verify_recover.py
 DOWNLOAD_LOG_CSV = LOG_DIR / "download_log.csv"
 ERRORS_LOG = LOG_DIR / "errors.log"
 SUMMARY_TXT = LOG_DIR / "download_summary.txt"
+INDEX_FILE = LOG_DIR / "library_index.bin"  # time + location lookup, see memories_search.py
+CHECKSUM_MANIFEST = LOG_DIR / "manifest-sha256.txt"  # BagIt-style "<sha256>  <path>" lines, kept across runs
+PROFILE_FOLDED = LOG_DIR / "profile.folded"       # flamegraph.pl / speedscope input (CPU microseconds)
+PROFILE_REPORT = LOG_DIR / "profile_report.txt"
+
+INDEX_GRID_DEG = 0.25  # spatial grid cell size in degrees
 
 
 # ============================================================
 # IMPORTS/PACKAGES
 # ============================================================
-import asyncio, aiohttp, aiofiles, csv, os, re, subprocess, shutil
+import asyncio, aiohttp, aiofiles, csv, os, re, struct, subprocess, shutil, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from tqdm.asyncio import tqdm
-from collections import defaultdict
+from collections import defaultdict, deque
+from array import array
+from bisect import bisect_left
+import hashlib, json, math, sys
+from concurrent.futures import ProcessPoolExecutor
+import contextvars, functools, time, tracemalloc, tarfile, mmap
+from urllib.parse import parse_qs, urlsplit
 
 
 # ============================================================
@@ -61,10 +186,196 @@ def setup_directories():
         d.mkdir(parents=True, exist_ok=True)
     
     # Clear old logs
-    for f in [MANIFEST_CSV, DOWNLOAD_LOG_CSV, ERRORS_LOG, SUMMARY_TXT]:
+    for f in [MANIFEST_CSV, MANIFEST_BIN, DOWNLOAD_LOG_CSV, ERRORS_LOG, SUMMARY_TXT, PROFILE_FOLDED, PROFILE_REPORT]:
         if f.exists():
             f.unlink()
 
+# ============================================================
+# EXPORT FOLDERS (BATCH MODE)
+# ============================================================
+def activate_export(base_dir):
+    """Point every path setting at another export folder (same layout as the settings above)"""
+    global BASE_DIR, TEMP_DIR, LOG_DIR, HTML_FILE
+    global MANIFEST_CSV, MANIFEST_BIN, DOWNLOAD_LOG_CSV, ERRORS_LOG, SUMMARY_TXT, INDEX_FILE, PROFILE_FOLDED, PROFILE_REPORT
+    global CHECKSUM_MANIFEST
+    
+    BASE_DIR = Path(base_dir)
+    TEMP_DIR = BASE_DIR / "_temp"
+    LOG_DIR = BASE_DIR / "_logs"
+    HTML_FILE = BASE_DIR / HTML_FILE.name
+    
+    MANIFEST_CSV = LOG_DIR / MANIFEST_CSV.name
+    MANIFEST_BIN = LOG_DIR / MANIFEST_BIN.name
+    DOWNLOAD_LOG_CSV = LOG_DIR / DOWNLOAD_LOG_CSV.name
+    ERRORS_LOG = LOG_DIR / ERRORS_LOG.name
+    SUMMARY_TXT = LOG_DIR / SUMMARY_TXT.name
+    INDEX_FILE = LOG_DIR / INDEX_FILE.name
+    CHECKSUM_MANIFEST = LOG_DIR / CHECKSUM_MANIFEST.name
+    PROFILE_FOLDED = LOG_DIR / PROFILE_FOLDED.name
+    PROFILE_REPORT = LOG_DIR / PROFILE_REPORT.name
+
+def current_export():
+    """The paths per-item download code needs, captured from the active settings"""
+    return {
+        "base_dir": BASE_DIR,
+        "temp_dir": TEMP_DIR,
+        "download_log_csv": DOWNLOAD_LOG_CSV,
+        "errors_log": ERRORS_LOG,
+        "checksum_manifest": CHECKSUM_MANIFEST,
+        "links_expire": export_link_deadline(HTML_FILE),
+    }
+
+def batch_dirs_from_args():
+    """Folders listed after --batch on the command line, else BATCH_EXPORT_DIRS"""
+    if "--batch" not in sys.argv:
+        return BATCH_EXPORT_DIRS
+    return [a for a in sys.argv[sys.argv.index("--batch") + 1:] if not a.startswith("--")]
+
+# ============================================================
+# LIBRARY LAYOUT
+# ============================================================
+MEDIA_NAME_REGEX = re.compile(r"^(\d{4}-\d{2}-\d{2}_\d{6})_(.+?)(?:_NO-OVERLAY)?$")
+
+def media_subdir(timestamp, media_id):
+    """Folder a memory belongs in under LIBRARY_LAYOUT, relative to BASE_DIR (posix style)"""
+    if LIBRARY_LAYOUT == "month":
+        return timestamp.strftime("%Y/%m")
+    if LIBRARY_LAYOUT == "day":
+        return timestamp.strftime("%Y/%m/%d")
+    if LIBRARY_LAYOUT == "hash":
+        return f"{timestamp.year}/{hashlib.sha1(media_id.encode()).hexdigest()[:2]}"
+    return str(timestamp.year)
+
+def parse_media_name(stem):
+    """(timestamp, media_id) from a file name stem like 2019-06-01_120000_<media_id>, else None"""
+    m = MEDIA_NAME_REGEX.match(stem)
+    if not m:
+        return None
+    try:
+        ts = datetime.strptime(m.group(1), "%Y-%m-%d_%H%M%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None  # looks like a memory but isn't a real date
+    return ts, m.group(2)
+
+# ============================================================
+# MEMORY ITEMS
+# ============================================================
+class MemoryItem:
+    """
+    One memory from the export. Slots and an integer capture time keep a
+    million of these small; item["field"] still works like the dicts used before.
+    """
+    __slots__ = ("url", "ts", "gps", "media_id", "media_type_hint", "export", "expires")
+    
+    def __init__(self, url, ts, gps, media_id, media_type_hint, export=None, expires=None):
+        self.url = url
+        self.ts = ts  # capture time, unix seconds (UTC)
+        self.gps = gps
+        self.media_id = media_id
+        self.media_type_hint = media_type_hint
+        self.export = export
+        self.expires = expires  # unix seconds the download link stops working, None = unknown
+    
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.ts, timezone.utc)
+    
+    @property
+    def year(self):
+        return self.timestamp.year
+    
+    # item["url"] reads item.url (properties included), like the dicts items used to be
+    __getitem__ = object.__getattribute__
+
+# ============================================================
+# LINK EXPIRY
+# ============================================================
+LINK_EXPIRED_ERROR = "Link expired (request a new export from Snapchat)"
+EXPIRY_PARAM_REGEX = re.compile(r"[?&](?:x-amz-expires|x-goog-expires|expires|se)=", re.IGNORECASE)
+
+def url_expiry(url):
+    """Unix time a signed URL stops working, from its own query parameters, or None"""
+    if not EXPIRY_PARAM_REGEX.search(url):
+        return None
+    
+    query = {key.lower(): values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+    try:
+        # AWS SigV4 / Google V4: signing time + lifetime in seconds
+        for date_key, lifetime_key in [("x-amz-date", "x-amz-expires"), ("x-goog-date", "x-goog-expires")]:
+            if date_key in query and lifetime_key in query:
+                signed = datetime.strptime(query[date_key], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                return int(signed.timestamp()) + int(query[lifetime_key])
+        # CloudFront / S3 V2 / Google V2: unix seconds
+        if "expires" in query:
+            return int(query["expires"])
+        # Azure SAS: ISO 8601
+        if "se" in query:
+            return int(datetime.fromisoformat(query["se"].replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        pass
+    return None
+
+def export_link_deadline(html_file):
+    """When links without their own expiry are assumed to stop working, or None (a guess: never used to skip a link)"""
+    if not EXPORT_LINK_LIFETIME_HOURS:
+        return None
+    if EXPORT_CREATED_AT:
+        created = datetime.strptime(EXPORT_CREATED_AT, "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc).timestamp()
+    elif Path(html_file).exists():
+        created = Path(html_file).stat().st_mtime
+    else:
+        return None
+    return int(created + EXPORT_LINK_LIFETIME_HOURS * 3600)
+
+def link_expiry(url, export_deadline):
+    """A link's own expiry if it has one, else the export's assumed deadline (for ordering and pace warnings)"""
+    return url_expiry(url) or export_deadline
+
+def link_expired(expires, now=None):
+    """True once a link is within EXPIRY_MARGIN_SECONDS of its expiry"""
+    return expires is not None and (now or time.time()) >= expires - EXPIRY_MARGIN_SECONDS
+
+def format_utc(unix):
+    return datetime.fromtimestamp(unix, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+def schedule_by_expiry(items):
+    """Returns (items soonest-expiring first, items whose own link expiry has passed)"""
+    if not EXPIRY_SCHEDULING or not items:
+        return items, []
+    
+    # Only a link's own expiry is trusted to skip it; the export deadline is just a guess
+    now = time.time()
+    deadline = items[0].export["links_expire"]
+    for item in items:
+        item.expires = url_expiry(item.url)
+    
+    dead = [item for item in items if link_expired(item.expires, now)]
+    live = [item for item in items if not link_expired(item.expires, now)]
+    live.sort(key=lambda item: expected_expiry(item) or math.inf)  # stable: ties keep export order
+    
+    if deadline and EXPORT_LINK_LIFETIME_HOURS:
+        age_hours = (now - deadline) / 3600 + EXPORT_LINK_LIFETIME_HOURS
+        print(f"  Export is {age_hours:.0f}h old; its links are assumed to work until {format_utc(deadline)} "
+              f"({max(deadline - now, 0) / 3600:.0f}h left)")
+    if dead:
+        print(f"  ⚠ {len(dead)} links have already expired and will not be tried. {LINK_EXPIRED_ERROR}.")
+    
+    return live, dead
+
+def expected_expiry(item):
+    """When an item's link is expected to stop working, or None"""
+    return item["expires"] or item["export"]["links_expire"]
+
+def links_at_risk(queues, rate, now):
+    """Queued items whose link will expire before workers reach them at `rate` items per second"""
+    active = sum(1 for q in queues if q) or 1  # workers take turns between exports
+    at_risk = 0
+    for queue in queues:
+        for position, item in enumerate(queue):
+            if link_expired(expected_expiry(item), now + position * active / rate):
+                at_risk += 1
+    return at_risk
+
 # ============================================================
 # HTML PARSING WITH DEDUPLICATION
 # ============================================================
@@ -85,7 +396,7 @@ def parse_html_and_dedupe(html_path):
     )
     
     items = []
-    seen_timestamps = defaultdict(list)
+    export = current_export()
     
     for m in ROW_REGEX.finditer(html):
         # Parse timestamp
@@ -102,24 +413,23 @@ def parse_html_and_dedupe(html_path):
         
         media_id = mid_match.group(1)
         
-        item = {
-            "url": url,
-            "timestamp": ts,
-            "year": ts.year,
-            "gps": m.group("gps"),
-            "media_id": media_id,
-            "media_type_hint": m.group("type")  # From HTML, but we'll verify via Content-Type
-        }
+        item = MemoryItem(
+            url,
+            int(ts.timestamp()),
+            m.group("gps"),
+            media_id,
+            sys.intern(m.group("type")),  # From HTML, but we'll verify via Content-Type
+            export
+        )
         
         items.append(item)
-        seen_timestamps[ts.isoformat()].append(item)
     
     # Deduplication: Compare both timestamp AND media_id
-    seen_unique = {}  # key: "timestamp|media_id"
+    seen_unique = {}  # key: (timestamp, media_id)
     duplicates_removed = 0
     
     for item in items:
-        key = f"{item['timestamp'].isoformat()}|{item['media_id']}"
+        key = (item.ts, item.media_id)
         
         if key in seen_unique:
             print(f"  Exact duplicate found: {item['timestamp'].isoformat()} | {item['media_id']}")
@@ -139,9 +449,12 @@ def parse_html_and_dedupe(html_path):
 # MANIFEST CREATION
 # ============================================================
 def create_manifest(items):
-    """Create manifest of expected files"""
+    """Create manifest of expected files (CSV, plus the same rows in columns for fast loading)"""
     print("Creating manifest...")
     
+    ts = array("q")
+    columns = {name: [] for name in MANIFEST_TEXT_COLUMNS}
+    
     with open(MANIFEST_CSV, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow([
@@ -151,25 +464,266 @@ def create_manifest(items):
             "gps",
             "original_url",
             "media_id",
-            "expected_basename"
+            "expected_basename",
+            "expected_dir"
         ])
         
         for item in items:
-            date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
-            expected_basename = f"{date_str}_{item['media_id']}"
+            timestamp = item["timestamp"]
+            url, gps, media_id, media_type_hint = item["url"], item["gps"], item["media_id"], item["media_type_hint"]
+            date_str = timestamp.strftime("%Y-%m-%d_%H%M%S")
+            expected_basename = f"{date_str}_{media_id}"
+            expected_dir = media_subdir(timestamp, media_id)
             
             writer.writerow([
-                item["timestamp"].isoformat(),
-                item["year"],
-                item["media_type_hint"],
-                item["gps"],
-                item["url"],
-                item["media_id"],
-                expected_basename
+                timestamp.isoformat(),
+                timestamp.year,
+                media_type_hint,
+                gps,
+                url,
+                media_id,
+                expected_basename,
+                expected_dir
             ])
+            
+            ts.append(int(timestamp.timestamp()))
+            columns["url"].append(url)
+            columns["media_id"].append(media_id)
+            columns["media_type_hint"].append(media_type_hint)
+            columns["gps"].append(gps)
+            columns["expected_path"].append(f"{expected_dir}/{expected_basename}")
+    
+    write_manifest_columns(MANIFEST_BIN, ts, columns)
     
     print(f"  Manifest saved: {MANIFEST_CSV}")
 
+# ============================================================
+# COLUMNAR MANIFEST
+# ============================================================
+# Layout: magic, row count, capture times (int64), then per text column
+# row offsets (uint64, count + 1) and the UTF-8 values, each ending in "\n".
+# Everything is little-endian and 8-byte aligned, so columns map straight
+# from the file without parsing.
+MANIFEST_MAGIC = b"SNAPMAN1"
+MANIFEST_TEXT_COLUMNS = ("url", "media_id", "media_type_hint", "gps", "expected_path")
+
+def write_manifest_columns(path, ts, columns):
+    """Write capture times + text columns (lists of str, one value per row)"""
+    with open(path, "wb") as f:
+        f.write(MANIFEST_MAGIC)
+        f.write(struct.pack("<Q", len(ts)))
+        f.write(_little_endian(ts).tobytes())
+        
+        for name in MANIFEST_TEXT_COLUMNS:
+            # Values are streamed out; their offsets are filled in afterwards
+            offsets_pos = f.tell()
+            offsets = array("Q", [0])
+            f.seek(8 * (len(ts) + 1), os.SEEK_CUR)
+            
+            size = 0
+            for value in columns[name]:
+                size += f.write(value.replace("\n", " ").encode("utf-8") + b"\n")
+                offsets.append(size)
+            f.write(b"\0" * (-size % 8))
+            
+            end = f.tell()
+            f.seek(offsets_pos)
+            f.write(_little_endian(offsets).tobytes())
+            f.seek(end)
+
+def _mapped_column(buf, pos, typecode, length):
+    """length numbers at pos, without a copy unless the machine is big-endian"""
+    view = memoryview(buf)[pos:pos + 8 * length].cast(typecode)
+    if sys.byteorder == "big":
+        return _little_endian(array(typecode, view))
+    return view
+
+class ManifestColumns:
+    """
+    A manifest written by write_manifest_columns, memory-mapped. Whole columns
+    are read straight from the file; rows are only built for the items asked
+    for, in the same shape as manifest.csv rows.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != MANIFEST_MAGIC:
+            raise ValueError(f"Not a columnar manifest: {path}")
+        
+        self.count = struct.unpack_from("<Q", self._map, 8)[0]
+        pos = 16
+        self.ts = _mapped_column(self._map, pos, "q", self.count)
+        pos += 8 * self.count
+        
+        self._text = {}
+        for name in MANIFEST_TEXT_COLUMNS:
+            offsets = _mapped_column(self._map, pos, "Q", self.count + 1)
+            pos += 8 * (self.count + 1)
+            self._text[name] = (offsets, pos)
+            pos += offsets[-1] + (-offsets[-1] % 8)
+    
+    def __len__(self):
+        return self.count
+    
+    def column(self, name):
+        """Every value of a text column, as a list of str"""
+        offsets, start = self._text[name]
+        if not self.count:
+            return []
+        return self._map[start:start + offsets[-1] - 1].decode("utf-8").split("\n")
+    
+    def value(self, name, row):
+        offsets, start = self._text[name]
+        return self._map[start + offsets[row]:start + offsets[row + 1] - 1].decode("utf-8")
+    
+    def row(self, row):
+        """One item as a manifest.csv row (dict of str)"""
+        timestamp = datetime.fromtimestamp(self.ts[row], timezone.utc)
+        expected_dir, _, expected_basename = self.value("expected_path", row).rpartition("/")
+        return {
+            "timestamp_utc": timestamp.isoformat(),
+            "year": str(timestamp.year),
+            "media_type_hint": self.value("media_type_hint", row),
+            "gps": self.value("gps", row),
+            "original_url": self.value("url", row),
+            "media_id": self.value("media_id", row),
+            "expected_basename": expected_basename,
+            "expected_dir": expected_dir,
+        }
+    
+    def select(self, rows):
+        """Some of the rows, built only when read (see ManifestRows)"""
+        return ManifestRows(self, list(rows))
+    
+    def __getitem__(self, row):
+        return self.row(row)
+    
+    def __iter__(self):
+        return (self.row(r) for r in range(self.count))
+
+class ManifestRows:
+    """A list of manifest rows that builds each row's dict when it is read, not up front"""
+    def __init__(self, manifest, rows):
+        self.manifest = manifest
+        self.rows = rows
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def __getitem__(self, i):
+        return self.manifest.row(self.rows[i])
+    
+    def __iter__(self):
+        return (self.manifest.row(r) for r in self.rows)
+
+# ============================================================
+# LIBRARY INDEX (TIME + LOCATION)
+# ============================================================
+INDEX_MAGIC = b"SNAPIDX1"
+INDEX_GRID_COLS = int(round(360 / INDEX_GRID_DEG))
+INDEX_GRID_ROWS = int(round(180 / INDEX_GRID_DEG))
+
+def _grid_cell(lat, lon):
+    row = min(int((lat + 90) / INDEX_GRID_DEG), INDEX_GRID_ROWS - 1)
+    col = min(int((lon + 180) / INDEX_GRID_DEG), INDEX_GRID_COLS - 1)
+    return row * INDEX_GRID_COLS + col
+
+def _little_endian(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+def build_index(items):
+    """
+    Write a compact index: columns sorted by capture time, plus a grid
+    (cell id -> rows) for located items. Built from the manifest items,
+    so queries never touch the media files.
+    """
+    print("Building library index...")
+    
+    rows = sorted(items, key=lambda i: i["timestamp"])
+    ts = array("q")
+    lat = array("d")
+    lon = array("d")
+    names = []
+    
+    for item in rows:
+        coords = parse_gps(item["gps"]) or (math.nan, math.nan)
+        ts.append(int(item["timestamp"].timestamp()))
+        lat.append(coords[0])
+        lon.append(coords[1])
+        names.append(f"{media_subdir(item['timestamp'], item['media_id'])}/{item['timestamp'].strftime('%Y-%m-%d_%H%M%S')}_{item['media_id']}")
+    
+    located = sorted((_grid_cell(lat[r], lon[r]), r) for r in range(len(rows)) if not math.isnan(lat[r]))
+    cells = array("q", (c for c, _ in located))
+    cell_rows = array("I", (r for _, r in located))
+    
+    with open(INDEX_FILE, "wb") as f:
+        f.write(INDEX_MAGIC)
+        f.write(struct.pack("<QQd", len(rows), len(located), INDEX_GRID_DEG))
+        for column in (ts, lat, lon, cells, cell_rows):
+            f.write(_little_endian(column).tobytes())
+        f.write("\n".join(names).encode("utf-8"))
+    
+    print(f"  Indexed {len(rows)} items ({len(located)} with location): {INDEX_FILE}")
+
+def load_index(index_path=None):
+    """Load an index written by build_index"""
+    index_path = index_path or INDEX_FILE
+    raw = Path(index_path).read_bytes()
+    if raw[:8] != INDEX_MAGIC:
+        raise ValueError(f"Not a library index: {index_path}")
+    
+    count, located, grid_deg = struct.unpack_from("<QQd", raw, 8)
+    if grid_deg != INDEX_GRID_DEG:
+        raise ValueError(f"Index grid is {grid_deg} degrees, expected {INDEX_GRID_DEG}; re-run memories_download.py")
+    
+    pos = 8 + 24
+    columns = {}
+    for name, typecode, length in [("ts", "q", count), ("lat", "d", count), ("lon", "d", count),
+                                   ("cells", "q", located), ("cell_rows", "I", located)]:
+        column = array(typecode)
+        size = column.itemsize * length
+        column.frombytes(raw[pos:pos + size])
+        columns[name] = _little_endian(column)
+        pos += size
+    
+    columns["names"] = raw[pos:].decode("utf-8").split("\n") if count else []
+    return columns
+
+def query_index(index, start=None, end=None, bbox=None):
+    """
+    Row numbers (time-ordered) captured in [start, end) and/or inside
+    bbox = (lat_min, lon_min, lat_max, lon_max). A bbox with lon_min > lon_max
+    wraps across the 180th meridian.
+    """
+    ts = index["ts"]
+    lo = bisect_left(ts, int(start.timestamp())) if start else 0
+    hi = bisect_left(ts, int(end.timestamp())) if end else len(ts)
+    
+    if bbox is None:
+        return list(range(lo, hi))
+    
+    lat_min, lon_min, lat_max, lon_max = bbox
+    lon_ranges = [(lon_min, lon_max)] if lon_min <= lon_max else [(lon_min, 180.0), (-180.0, lon_max)]
+    cells, cell_rows, lat, lon = index["cells"], index["cell_rows"], index["lat"], index["lon"]
+    
+    found = []
+    for lon_a, lon_b in lon_ranges:
+        first, last = _grid_cell(lat_min, lon_a), _grid_cell(lat_max, lon_b)
+        col_a, col_b = first % INDEX_GRID_COLS, last % INDEX_GRID_COLS
+        
+        # Each grid row of the box is one contiguous run of cell ids
+        for grid_row in range(first // INDEX_GRID_COLS, last // INDEX_GRID_COLS + 1):
+            base = grid_row * INDEX_GRID_COLS
+            i = bisect_left(cells, base + col_a)
+            j = bisect_left(cells, base + col_b + 1)
+            for r in cell_rows[i:j]:
+                if lo <= r < hi and lat_min <= lat[r] <= lat_max and lon_a <= lon[r] <= lon_b:
+                    found.append(r)
+    
+    return sorted(set(found))
+
 # ============================================================
 # SKIP EXISTING FILES
 # ============================================================
@@ -179,17 +733,36 @@ def check_existing_files(items):
     
     to_download = []
     skipped = 0
+    bundled = load_bundle_index(BASE_DIR)
+    uploaded = {name.rsplit(".", 1)[0] for name in object_store.list_files(BASE_DIR)} if S3_BUCKET else set()
+    
+    # List each folder once (name without extension -> file name) instead of a glob per item
+    listings = {}
+    def files_in(subdir):
+        if subdir not in listings:
+            listings[subdir] = {}
+            directory = BASE_DIR / subdir
+            if directory.is_dir():
+                for entry in os.scandir(directory):
+                    if entry.is_file():
+                        listings[subdir].setdefault(entry.name.partition(".")[0], entry.name)
+        return listings[subdir]
     
     for item in items:
-        year_dir = BASE_DIR / str(item["year"])
-        date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
+        timestamp = item["timestamp"]
+        subdir = media_subdir(timestamp, item["media_id"])
+        date_str = timestamp.strftime("%Y-%m-%d_%H%M%S")
         base_name = f"{date_str}_{item['media_id']}"
         
+        if item["media_id"] in bundled or f"{subdir}/{base_name}" in uploaded:
+            skipped += 1
+            continue
+        
         # Check for any file with this base name (we don't know extension yet)
-        existing = list(year_dir.glob(f"{base_name}.*")) if year_dir.exists() else []
+        existing = files_in(subdir).get(base_name)
         
         if existing:
-            print(f"  Skipping (exists): {existing[0].name}")
+            print(f"  Skipping (exists): {existing}")
             skipped += 1
             continue
         
@@ -207,9 +780,10 @@ csv_lock = asyncio.Lock()
 
 async def log_download(item, status, error_type="", error_msg="", attempt=1, filename=""):
     """Log download attempt to CSV"""
+    log_path = item["export"]["download_log_csv"]
     async with csv_lock:
-        file_exists = DOWNLOAD_LOG_CSV.exists()
-        async with aiofiles.open(DOWNLOAD_LOG_CSV, "a", encoding="utf-8") as f:
+        file_exists = log_path.exists()
+        async with aiofiles.open(log_path, "a", encoding="utf-8") as f:
             if not file_exists:
                 await f.write("timestamp_utc,media_id,filename,status,error_type,error_message,attempt_number,download_time\n")
             
@@ -219,25 +793,1222 @@ async def log_download(item, status, error_type="", error_msg="", attempt=1, fil
 
 async def log_error(item, error_msg, attempt):
     """Log error to errors.log"""
-    async with aiofiles.open(ERRORS_LOG, "a", encoding="utf-8") as f:
+    async with aiofiles.open(item["export"]["errors_log"], "a", encoding="utf-8") as f:
         timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
         await f.write(f"[{timestamp}] MEDIA_ID: {item['media_id']} | URL: {item['url']} | ERROR: {error_msg} | ATTEMPT: {attempt}\n")
 
+async def log_checksum(item, output_path, digest):
+    """Record a saved file's SHA-256 in the checksum manifest"""
+    export = item["export"]
+    rel = output_path.relative_to(export["base_dir"]).as_posix()
+    async with csv_lock:
+        async with aiofiles.open(export["checksum_manifest"], "a", encoding="utf-8") as f:
+            await f.write(f"{digest}  {rel}\n")
+
+# ============================================================
+# CHECKSUM MANIFEST
+# ============================================================
+HASH_READ_SIZE = 8 * 1024 * 1024
+
+def file_sha256(path):
+    """SHA-256 of a file, hashed from a memory map in large sequential slices"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # hashlib releases the GIL on big updates, so threads hash in parallel
+            for start in range(0, size, HASH_READ_SIZE):
+                digest.update(mm[start:start + HASH_READ_SIZE])
+    return digest.hexdigest()
+
+def load_checksum_manifest(manifest_path=None):
+    """Relative path -> SHA-256; the latest line wins when a file was downloaded again"""
+    manifest_path = manifest_path or CHECKSUM_MANIFEST
+    checksums = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                digest, _, rel = line.rstrip("\n").partition("  ")
+                if rel:
+                    checksums[rel] = digest
+    return checksums
+
+def append_checksum(manifest_path, rel, digest):
+    """Synchronous log_checksum() for scripts without an event loop"""
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write(f"{digest}  {rel}\n")
+
+# ============================================================
+# PROFILING
+# ============================================================
+_profile_stack = contextvars.ContextVar("profile_stack", default=())
+
+class LoopProfiler:
+    """Event-loop lag, blocking steps, per-stage wall/CPU time and tracemalloc peaks"""
+    
+    def __init__(self):
+        self.enabled = False
+        self.stages = defaultdict(lambda: [0, 0.0, 0.0])  # stack -> [calls, wall, cpu]
+        self.lag_samples = []
+        self.blocking = []
+    
+    def start(self):
+        self.enabled = True
+        self.loop_thread = threading.get_ident()  # stages are only recorded from the event loop's thread
+        tracemalloc.start(10)
+        self._lag_task = asyncio.create_task(self._sample_lag())
+        self._started = time.perf_counter()
+    
+    async def _sample_lag(self):
+        while True:
+            expected = time.perf_counter() + PROFILE_LAG_INTERVAL
+            await asyncio.sleep(PROFILE_LAG_INTERVAL)
+            self.lag_samples.append(max(time.perf_counter() - expected, 0.0))
+    
+    def record(self, stack, wall, cpu):
+        entry = self.stages[stack]
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+    
+    def record_blocking(self, stack, seconds, where):
+        self.blocking.append(f"{seconds * 1000:.0f} ms in {' > '.join(stack)} ({where})")
+    
+    async def stop(self):
+        """Stop sampling and write the folded-stack profile and text report"""
+        self._lag_task.cancel()
+        try:
+            await self._lag_task
+        except asyncio.CancelledError:
+            pass
+        
+        elapsed = time.perf_counter() - self._started
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        top_allocations = snapshot.statistics("lineno")[:10]
+        tracemalloc.stop()
+        self.enabled = False
+        
+        # Folded stacks want self time: subtract what directly nested stages already account for
+        with open(PROFILE_FOLDED, "w", encoding="utf-8") as f:
+            for stack, (_, _, cpu) in sorted(self.stages.items()):
+                children = sum(v[2] for k, v in self.stages.items() if len(k) == len(stack) + 1 and k[:-1] == stack)
+                self_us = int(max(cpu - children, 0.0) * 1_000_000)
+                if self_us:
+                    f.write(f"{';'.join(stack)} {self_us}\n")
+        
+        lags = sorted(self.lag_samples) or [0.0]
+        report = []
+        report.append("=" * 70)
+        report.append("DOWNLOAD PROFILE")
+        report.append("=" * 70)
+        report.append(f"Run time: {elapsed:.1f} s")
+        report.append("")
+        report.append("EVENT LOOP LAG")
+        report.append("-" * 70)
+        report.append(f"Samples: {len(self.lag_samples)} (every {PROFILE_LAG_INTERVAL * 1000:.0f} ms)")
+        report.append(f"p50: {lags[len(lags) // 2] * 1000:.1f} ms   p99: {lags[int(len(lags) * 0.99)] * 1000:.1f} ms   "
+                      f"max: {lags[-1] * 1000:.1f} ms")
+        report.append("")
+        report.append("STAGES (wall vs CPU; low CPU share = waiting on network/disk/FFmpeg)")
+        report.append("-" * 70)
+        for stack, (calls, wall, cpu) in sorted(self.stages.items(), key=lambda kv: -kv[1][1]):
+            share = cpu / wall * 100 if wall else 0
+            report.append(f"{' > '.join(stack)}")
+            report.append(f"    calls: {calls}  wall: {wall:.2f} s  cpu: {cpu:.2f} s  ({share:.0f}% on CPU)")
+        report.append("")
+        report.append(f"BLOCKING CALLS (event loop held > {PROFILE_BLOCKING_THRESHOLD * 1000:.0f} ms): {len(self.blocking)}")
+        report.append("-" * 70)
+        for message in self.blocking[:50]:
+            report.append(f"  {message}")
+        if len(self.blocking) > 50:
+            report.append(f"  ... and {len(self.blocking) - 50} more")
+        report.append("")
+        report.append(f"MEMORY (tracemalloc): peak {peak / 1024 / 1024:.1f} MB, at exit {current / 1024 / 1024:.1f} MB")
+        report.append("-" * 70)
+        for stat in top_allocations:
+            report.append(f"  {stat}")
+        report.append("")
+        report.append(f"Flamegraph input: {PROFILE_FOLDED}")
+        report.append("=" * 70)
+        
+        report_text = "\n".join(report)
+        print("\n" + report_text)
+        with open(PROFILE_REPORT, "w", encoding="utf-8") as f:
+            f.write(report_text)
+
+profiler = LoopProfiler()
+
+class _TimedAwait:
+    """Times each step of a coroutine on the event loop (CPU) and its total lifetime (wall)"""
+    
+    def __init__(self, coro, name):
+        self.coro = coro
+        self.stack = _profile_stack.get() + (name,)
+    
+    def __await__(self):
+        parent = _profile_stack.get()
+        wall_start = time.perf_counter()
+        cpu = 0.0
+        value, error = None, None
+        try:
+            while True:
+                token = _profile_stack.set(self.stack)
+                step_start, step_cpu_start = time.perf_counter(), time.thread_time()
+                reported = len(profiler.blocking)
+                try:
+                    step = self.coro.throw(error) if error else self.coro.send(value)
+                except StopIteration as done:
+                    return done.value
+                finally:
+                    cpu += time.thread_time() - step_cpu_start
+                    _profile_stack.reset(token)
+                    held = time.perf_counter() - step_start
+                    # Report at the innermost timed stage only
+                    if held > PROFILE_BLOCKING_THRESHOLD and len(profiler.blocking) == reported:
+                        frame = self.coro.cr_frame
+                        where = f"until line {frame.f_lineno}" if frame else "until it returned"
+                        profiler.record_blocking(self.stack, held, where)
+                
+                try:
+                    value, error = (yield step), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            profiler.record(self.stack, time.perf_counter() - wall_start, cpu)
+            _profile_stack.set(parent)
+
+def profiled(fn):
+    """Record wall and CPU time for a function under --profile (no-op otherwise, and off the loop thread)"""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return await fn(*args, **kwargs)
+            return await _TimedAwait(fn(*args, **kwargs), fn.__qualname__)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # Calls run via asyncio.to_thread would mix worker-thread time into the loop's stages
+            if not profiler.enabled or threading.get_ident() != profiler.loop_thread:
+                return fn(*args, **kwargs)
+            stack = _profile_stack.get() + (fn.__qualname__,)
+            token = _profile_stack.set(stack)
+            wall_start, cpu_start = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                wall = time.perf_counter() - wall_start
+                profiler.record(stack, wall, time.thread_time() - cpu_start)
+                if wall > PROFILE_BLOCKING_THRESHOLD:
+                    profiler.record_blocking(stack, wall, "synchronous call")
+                _profile_stack.reset(token)
+    return wrapper
+
+# ============================================================
+# MEMORY BUDGET
+# ============================================================
+class MemoryBudget:
+    """Global byte budget shared by all workers; reserve() waits while it is used up"""
+    
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self._cond = asyncio.Condition()
+    
+    async def reserve(self, nbytes):
+        # An item bigger than the whole budget may still run, but only on its own
+        nbytes = min(nbytes, self.limit)
+        async with self._cond:
+            if self.in_use and self.in_use + nbytes > self.limit:
+                self.waits += 1
+                await self._cond.wait_for(lambda: self.in_use == 0 or self.in_use + nbytes <= self.limit)
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+        return nbytes
+    
+    async def release(self, nbytes):
+        async with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+    
+    @asynccontextmanager
+    async def hold(self, nbytes):
+        reserved = await self.reserve(nbytes)
+        try:
+            yield
+        finally:
+            await self.release(reserved)
+
+memory_budget = MemoryBudget(MEMORY_BUDGET_MB * 1024 * 1024)
+
+def estimate_memory(resp):
+    """Bytes a response will need in memory, from Content-Length and Content-Type"""
+    length = resp.content_length or UNKNOWN_SIZE_ESTIMATE_MB * 1024 * 1024
+    if "application/zip" in resp.headers.get("Content-Type", "").lower():
+        length *= ZIP_MEMORY_FACTOR
+    return length
+
+# ============================================================
+# PROGRESS (BYTES + ITEMS + MERGES)
+# ============================================================
+class TransferProgress:
+    """
+    Counters updated by all workers (plain integer adds on the event loop),
+    drawn as byte/item/merge bars by a single task every PROGRESS_REFRESH_SECONDS.
+    """
+    
+    def start(self, total_items, desc):
+        self.desc = desc
+        self.total_items = total_items
+        self.items_done = 0
+        self.bytes_done = 0
+        self.bytes_expected = 0  # sum of Content-Length of responses seen so far
+        self.items_sized = 0
+        self.merges_started = 0
+        self.merges_done = 0
+        self._task = asyncio.create_task(self._render_loop())
+    
+    def estimated_total_bytes(self):
+        """Known sizes plus the average size for items that haven't started yet"""
+        if self.items_done >= self.total_items:
+            return self.bytes_done
+        if not self.items_sized:
+            return None
+        average = self.bytes_expected / self.items_sized
+        return int(self.bytes_expected + average * max(self.total_items - self.items_sized, 0))
+    
+    async def track(self, coro):
+        """Await a per-item coroutine and count it as finished"""
+        try:
+            return await coro
+        finally:
+            self.items_done += 1
+    
+    async def _render_loop(self):
+        byte_bar = tqdm(desc=f"{self.desc} (data)", unit="B", unit_scale=True, unit_divisor=1024, position=0)
+        item_bar = tqdm(desc=f"{self.desc} (items)", total=self.total_items, unit="item", position=1)
+        merge_bar = tqdm(desc="Merging overlays", total=0, unit="file", position=2)
+        
+        def draw():
+            byte_bar.total = self.estimated_total_bytes()
+            byte_bar.update(self.bytes_done - byte_bar.n)
+            item_bar.update(self.items_done - item_bar.n)
+            merge_bar.total = self.merges_started
+            merge_bar.update(self.merges_done - merge_bar.n)
+            for bar in (byte_bar, item_bar, merge_bar):
+                bar.refresh()
+        
+        try:
+            while True:
+                draw()
+                await asyncio.sleep(PROGRESS_REFRESH_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            draw()
+            for bar in (byte_bar, item_bar, merge_bar):
+                bar.close()
+    
+    async def stop(self):
+        await asyncio.sleep(0)
+        self._task.cancel()
+        await self._task
+
+progress = TransferProgress()
+
+IMAGE_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/heic": ".heic"}
+
+def sniff_content_type(head, header_type):
+    """
+    Content type from the file signature in the first bytes. Falls back to the
+    Content-Type header for unrecognised data; raises on HTML/JSON error bodies.
+    """
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[4:8] == b"ftyp":
+        return "image/heic" if head[8:12] in (b"heic", b"heix", b"mif1") else "video/mp4"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    
+    if not head:
+        raise Exception("Empty response body")
+    if bytes(head).lstrip()[:1] in (b"<", b"{") or "text/" in header_type:
+        snippet = bytes(head).decode("utf-8", "replace").strip()[:40]
+        raise Exception(f"Error page instead of media ({snippet!r}); the link may have expired")
+    
+    return header_type
+
+@profiled
+async def read_media(resp, transfer=None):
+    """
+    Read a response in chunks, counting bytes for the progress display as they arrive.
+    The type is decided from the first SNIFF_BYTES, so error pages are dropped before
+    the rest of the body is downloaded. Returns (content_type, body).
+    
+    The rest is still collected in memory (within memory_budget) rather than streamed
+    to disk: MP4 faststart moves the moov box ahead of mdat, ZIPs are read from their
+    central directory at the end, and a hedged request only keeps the winner's body.
+    
+    transfer: optional dict whose "bytes" counts this response alone (used for hedging).
+    """
+    if transfer is None:
+        transfer = {"bytes": 0}
+    header_type = resp.headers.get("Content-Type", "").lower()
+    length = resp.content_length
+    if length:
+        progress.bytes_expected += length
+        progress.items_sized += 1
+    
+    body = bytearray()
+    try:
+        while len(body) < SNIFF_BYTES:
+            chunk = await resp.content.read(SNIFF_BYTES - len(body))
+            if not chunk:
+                break
+            body += chunk
+            progress.bytes_done += len(chunk)
+            transfer["bytes"] += len(chunk)
+            await bandwidth.consume(len(chunk))
+        
+        content_type = sniff_content_type(body, header_type)
+        
+        async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            body += chunk
+            progress.bytes_done += len(chunk)
+            transfer["bytes"] += len(chunk)
+            await bandwidth.consume(len(chunk))
+    except BaseException:
+        # A retry will count this item again
+        progress.bytes_done -= len(body)
+        if length:
+            progress.bytes_expected -= length
+            progress.items_sized -= 1
+        raise
+    
+    return content_type, body
+
+# ============================================================
+# BANDWIDTH LIMIT (TOKEN BUCKET)
+# ============================================================
+BANDWIDTH_RECHECK_SECONDS = 5
+BANDWIDTH_BURST_SECONDS = 0.5  # unused allowance kept while idle, in seconds of traffic
+
+class BandwidthLimiter:
+    """
+    One token bucket for every worker: each chunk read takes its size in
+    tokens, refilled at the current limit. Waiters queue behind one lock,
+    so the shared rate is split fairly in arrival order.
+    """
+    
+    def __init__(self):
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.rate = None          # bytes per second, None = unlimited
+        self._checked = None
+        self._file_stamp = None
+        self._overrides = {}
+        self._lock = asyncio.Lock()
+    
+    def _read_file(self):
+        try:
+            st = BANDWIDTH_FILE.stat()
+        except FileNotFoundError:
+            self._file_stamp, self._overrides = None, {}
+            return
+        
+        if (st.st_mtime_ns, st.st_size) != self._file_stamp:
+            self._file_stamp = (st.st_mtime_ns, st.st_size)
+            try:
+                self._overrides = json.loads(BANDWIDTH_FILE.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"\n  ⚠ Ignoring {BANDWIDTH_FILE.name}: {e}")
+                self._overrides = {}
+    
+    def limit_now(self):
+        """MB/s allowed right now from the schedule, else the flat limit (None = unlimited)"""
+        limit = self._overrides.get("limit_mb_s", BANDWIDTH_LIMIT_MBPS)
+        schedule = self._overrides.get("schedule", BANDWIDTH_SCHEDULE)
+        
+        now = datetime.now().strftime("%H:%M")
+        for start, end, window_limit in schedule:
+            inside = start <= now < end if start <= end else (now >= start or now < end)
+            if inside:
+                return window_limit
+        return limit
+    
+    def current_rate(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= BANDWIDTH_RECHECK_SECONDS:
+            first = self._checked is None
+            self._checked = now
+            self._read_file()
+            limit = self.limit_now()
+            rate = limit * 1024 * 1024 if limit else None
+            if rate != self.rate and not first:
+                print(f"\n  Bandwidth limit now {f'{limit} MB/s' if rate else 'off'}")
+            self.rate = rate
+        return self.rate
+    
+    def _refill(self, rate):
+        now = time.monotonic()
+        self.tokens = min(rate * BANDWIDTH_BURST_SECONDS, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+    
+    async def consume(self, nbytes):
+        """Wait until nbytes fit under the current limit"""
+        rate = self.current_rate()
+        if not rate:
+            return
+        
+        async with self._lock:
+            self._refill(rate)
+            self.tokens -= nbytes
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / rate)
+                self._refill(rate)
+
+bandwidth = BandwidthLimiter()
+
+# ============================================================
+# HEDGED REQUESTS
+# ============================================================
+HEDGE_CHECK_SECONDS = 0.25
+HEDGE_SAMPLE_WINDOW = 500         # throughput of the most recent transfers
+HEDGE_MIN_SAMPLE_BYTES = 256 * 1024  # smaller bodies mostly measure latency, not throughput
+
+class Hedger:
+    """
+    Watches each transfer's throughput against the HEDGE_PERCENTILE of recently
+    finished transfers. A transfer that falls behind gets a second request for
+    the same URL; the first complete body wins and the other is cancelled.
+    """
+    
+    def __init__(self):
+        self.samples = deque(maxlen=HEDGE_SAMPLE_WINDOW)
+        self.bytes_total = 0   # bytes read by all requests, hedges included
+        self.hedge_bytes = 0   # bytes read by hedge requests
+        self.in_flight = 0
+        self.started = 0
+        self.won = 0
+        self.wasted_bytes = 0  # bytes read by whichever request lost
+    
+    def threshold(self):
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(len(ordered) * HEDGE_PERCENTILE / 100)]
+    
+    def should_hedge(self, transfer):
+        elapsed = time.monotonic() - transfer["started"]
+        threshold = self.threshold()
+        return (
+            threshold is not None
+            and elapsed >= HEDGE_MIN_SECONDS
+            and transfer["bytes"] / elapsed < threshold
+            and self.in_flight < HEDGE_MAX_IN_FLIGHT
+            and self.hedge_bytes <= self.bytes_total * HEDGE_MAX_EXTRA_PERCENT / 100
+        )
+    
+    async def _hedge_request(self, session, item, transfer):
+        async with session.get(
+            item["url"],
+            allow_redirects=True,
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT)
+        ) as resp:
+            if resp.status != 200:
+                raise Exception(f"HTTP {resp.status}")
+            
+            # The primary request already holds budget for one copy; this covers the second
+            async with memory_budget.hold(estimate_memory(resp)):
+                return await read_media(resp, transfer)
+    
+    async def read(self, session, item, resp):
+        """read_media(resp), hedged with a second request if it falls behind"""
+        if not HEDGE_REQUESTS:
+            return await read_media(resp)
+        
+        primary = {"bytes": 0, "started": time.monotonic()}
+        hedge = None
+        tasks = {asyncio.ensure_future(read_media(resp, primary)): primary}
+        transfers = [primary]
+        winner = None
+        
+        try:
+            while True:
+                done, _ = await asyncio.wait(tasks, timeout=HEDGE_CHECK_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    transfer = tasks.pop(task)
+                    if task.exception() is not None and tasks:
+                        continue  # the other request may still make it
+                    result = task.result()  # raises when every request failed
+                    winner = transfer
+                    return result
+                
+                if hedge is None and self.should_hedge(primary):
+                    hedge = {"bytes": 0, "started": time.monotonic()}
+                    transfers.append(hedge)
+                    self.started += 1
+                    self.in_flight += 1
+                    tasks[asyncio.ensure_future(self._hedge_request(session, item, hedge))] = hedge
+        
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            
+            self.bytes_total += sum(t["bytes"] for t in transfers)
+            if hedge is not None:
+                self.in_flight -= 1
+                self.hedge_bytes += hedge["bytes"]
+                self.won += winner is hedge
+                self.wasted_bytes += sum(t["bytes"] for t in transfers if t is not winner)
+            
+            if winner is not None and winner["bytes"] >= HEDGE_MIN_SAMPLE_BYTES:
+                elapsed = time.monotonic() - winner["started"]
+                if elapsed > 0:
+                    self.samples.append(winner["bytes"] / elapsed)
+
+hedger = Hedger()
+
+# ============================================================
+# DISK WRITER
+# ============================================================
+class DiskWriter:
+    """
+    Writes finished files from a bounded thread pool: one round-trip per file
+    covering mkdir, preallocation, the write itself, mtime and fsync.
+    """
+    
+    def __init__(self, threads, fsync_policy, batch_size):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer")
+        self.fsync_policy = fsync_policy
+        self.batch_size = batch_size
+        self.known_dirs = set()
+        self.pending_sync = []
+        self._lock = threading.Lock()
+    
+    def ensure_dir(self, directory):
+        """mkdir once per directory for the whole run"""
+        if directory in self.known_dirs:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self.known_dirs.add(directory)
+    
+    def _write(self, path, chunks, mtime):
+        self.ensure_dir(path.parent)
+        total = sum(len(c) for c in chunks)
+        digest = hashlib.sha256()
+        
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if PREALLOCATE_FILES and total and hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, total)
+                except OSError:
+                    pass  # filesystem doesn't support it (e.g. some NAS mounts)
+            
+            for chunk in chunks:
+                digest.update(chunk)
+                view = memoryview(chunk)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+            
+            if self.fsync_policy == "file":
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        
+        self._finalize(path, mtime, synced=self.fsync_policy == "file")
+        return digest.hexdigest()
+    
+    def _finalize(self, path, mtime, synced=False):
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        
+        if self.fsync_policy == "file" and not synced:
+            self._fsync_paths([path])
+        elif self.fsync_policy == "batch":
+            with self._lock:
+                self.pending_sync.append(path)
+                batch = self.pending_sync if len(self.pending_sync) >= self.batch_size else None
+                if batch:
+                    self.pending_sync = []
+            if batch:
+                self._fsync_paths(batch)
+    
+    def _fsync_paths(self, paths):
+        # Flush file contents, then each parent directory once so the names are durable too
+        for path in paths + sorted({p.parent for p in paths}):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass  # directories can't be fsynced on Windows
+            finally:
+                os.close(fd)
+    
+    @profiled
+    async def write(self, path, chunks, mtime=None):
+        """Write chunks to path and set its mtime. Returns the SHA-256 of what was written."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._write, path, chunks, mtime)
+    
+    def _finalize_and_hash(self, path, mtime):
+        self._finalize(path, mtime)
+        return file_sha256(path)
+    
+    async def finalize(self, path, mtime=None):
+        """Set mtime and apply the fsync policy to a file written by someone else (e.g. FFmpeg). Returns its SHA-256."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._finalize_and_hash, path, mtime)
+    
+    async def flush(self):
+        """fsync anything still waiting in the current batch"""
+        with self._lock:
+            batch, self.pending_sync = self.pending_sync, []
+        if batch:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._fsync_paths, batch)
+
+disk_writer = DiskWriter(WRITER_THREADS, FSYNC_POLICY, FSYNC_BATCH_SIZE)
+
+# ============================================================
+# BUNDLES (PACKED SMALL MEDIA)
+# ============================================================
+BUNDLE_DIR_NAME = "_bundles"
+
+class BundleWriter:
+    """
+    Appends items to uncompressed tar bundles. Each bundle has a sidecar
+    <bundle>.idx (media_id,name,offset,size) so any item can be read with
+    one seek, and the tars still open in any archive tool.
+    """
+    
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+    
+    def bundle_path(self, base_dir, item):
+        period = item["timestamp"].strftime("%Y" if BUNDLE_MODE == "year" else "%Y-%m")
+        return base_dir / BUNDLE_DIR_NAME / f"{period}.tar"
+    
+    def _append(self, bundle, name, media_id, chunks, mtime):
+        with self._locks_guard:
+            lock = self._locks.setdefault(bundle, threading.Lock())
+        
+        with lock:
+            disk_writer.ensure_dir(bundle.parent)
+            size = sum(len(c) for c in chunks)
+            digest = hashlib.sha256()
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.PAX_FORMAT)
+            
+            with open(bundle, "r+b" if bundle.exists() else "wb") as f:
+                # Write over the previous end-of-archive marker (two zero blocks)
+                end = f.seek(0, os.SEEK_END)
+                start = end - 2 * tarfile.BLOCKSIZE if end >= 2 * tarfile.BLOCKSIZE else end
+                f.seek(start)
+                f.write(header)
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.write(b"\0" * (-size % tarfile.BLOCKSIZE))
+                f.write(b"\0" * (2 * tarfile.BLOCKSIZE))
+                if disk_writer.fsync_policy == "file":
+                    f.flush()
+                    os.fsync(f.fileno())
+            
+            # Index line last: a crash in between just means the item is downloaded again
+            with open(bundle.with_suffix(".idx"), "a", encoding="utf-8") as idx:
+                idx.write(f"{media_id},{name},{start + len(header)},{size}\n")
+            return digest.hexdigest()
+    
+    async def add(self, item, output_path, chunks, mtime):
+        base_dir = item["export"]["base_dir"]
+        bundle = self.bundle_path(base_dir, item)
+        name = output_path.relative_to(base_dir).as_posix()
+        return await asyncio.get_running_loop().run_in_executor(
+            disk_writer.executor, self._append, bundle, name, item["media_id"], chunks, mtime
+        )
+
+bundle_writer = BundleWriter()
+
+def load_bundle_index(base_dir):
+    """media_id -> (bundle_path, name, offset, size) for every bundle in a library"""
+    entries = {}
+    bundle_dir = Path(base_dir) / BUNDLE_DIR_NAME
+    if not bundle_dir.exists():
+        return entries
+    
+    for idx in sorted(bundle_dir.glob("*.idx")):
+        bundle = idx.with_suffix(".tar")
+        with open(idx, "r", encoding="utf-8") as f:
+            for line in f:
+                media_id, name, offset, size = line.rstrip("\n").rsplit(",", 3)
+                entries[media_id] = (bundle, name, int(offset), int(size))
+    return entries
+
+def read_bundled(entry):
+    """Bytes of one bundled item, from a load_bundle_index() entry"""
+    bundle, _, offset, size = entry
+    with open(bundle, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+async def save_output(item, output_path, chunks, mtime):
+    """
+    Write a finished item as a loose file, or into its bundle when BUNDLE_MODE is on,
+    or upload it when S3_BUCKET is set. Returns (bundled, sha256).
+    """
+    if S3_BUCKET:
+        return False, await object_store.upload(item["export"]["base_dir"], output_path, chunks, mtime)
+    if BUNDLE_MODE and sum(len(c) for c in chunks) <= BUNDLE_MAX_ITEM_MB * 1024 * 1024:
+        return True, await bundle_writer.add(item, output_path, chunks, mtime)
+    return False, await disk_writer.write(output_path, chunks, mtime)
+
+# ============================================================
+# OBJECT STORAGE (S3-COMPATIBLE)
+# ============================================================
+class ChunkReader:
+    """Read-only file object over a list of byte chunks, so uploads don't join them into one copy"""
+    
+    def __init__(self, chunks):
+        self.chunks = deque(memoryview(c) for c in chunks if len(c))
+    
+    def read(self, size=-1):
+        out = []
+        wanted = size if size >= 0 else float("inf")
+        while self.chunks and wanted > 0:
+            chunk = self.chunks.popleft()
+            if len(chunk) > wanted:
+                self.chunks.appendleft(chunk[wanted:])
+                chunk = chunk[:wanted]
+            out.append(chunk)
+            wanted -= len(chunk)
+        return b"".join(out)
+
+class ObjectStore:
+    """
+    Uploads finished items to S3_BUCKET. boto3's transfer manager splits
+    anything over S3_PART_SIZE_MB into a multipart upload with
+    S3_UPLOAD_THREADS parts in flight.
+    """
+    
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self.executor = None
+        self.transfer_config = None
+    
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3  # optional dependency, only needed with S3_BUCKET
+                from boto3.s3.transfer import TransferConfig
+                
+                self._client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL)
+                part_size = S3_PART_SIZE_MB * 1024 * 1024
+                self.transfer_config = TransferConfig(
+                    multipart_threshold=part_size,
+                    multipart_chunksize=part_size,
+                    max_concurrency=S3_UPLOAD_THREADS,
+                )
+        return self._client
+    
+    def key_prefix(self, base_dir):
+        return f"{S3_PREFIX}{Path(base_dir).name}/"
+    
+    def _upload(self, key, body, mtime):
+        client = self.client
+        if isinstance(body, Path):
+            digest = file_sha256(body)
+        else:
+            digest = hashlib.sha256()
+            for chunk in body:
+                digest.update(chunk)
+            digest = digest.hexdigest()
+        
+        # S3 can't set Last-Modified, so the capture time travels as metadata
+        metadata = {"sha256": digest}
+        if mtime is not None:
+            metadata["capture-time"] = datetime.fromtimestamp(mtime, timezone.utc).isoformat()
+        extra = {"Metadata": metadata}
+        
+        if isinstance(body, Path):
+            client.upload_file(str(body), S3_BUCKET, key, ExtraArgs=extra, Config=self.transfer_config)
+        else:
+            client.upload_fileobj(ChunkReader(body), S3_BUCKET, key, ExtraArgs=extra, Config=self.transfer_config)
+        return digest
+    
+    async def upload(self, base_dir, output_path, body, mtime=None):
+        """Upload chunks (or a local file, e.g. FFmpeg output) as <base_dir name>/<path under base_dir>. Returns its SHA-256."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT, thread_name_prefix="upload")
+        key = self.key_prefix(base_dir) + output_path.relative_to(base_dir).as_posix()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._upload, key, body, mtime)
+    
+    def list_files(self, base_dir):
+        """Path under base_dir -> size for every object uploaded for this export"""
+        prefix = self.key_prefix(base_dir)
+        files = {}
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=S3_BUCKET, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                files[obj["Key"][len(prefix):]] = obj["Size"]
+        return files
+
+object_store = ObjectStore()
+
+# ============================================================
+# METADATA EMBEDDING
+# ============================================================
+MP4_EPOCH_OFFSET = 2082844800  # seconds between 1904-01-01 and 1970-01-01
+MP4_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"udta", b"edts"}
+
+def parse_gps(gps_str):
+    """Parse 'Latitude, Longitude: 12.34, -56.78' into (lat, lon), or None"""
+    numbers = re.findall(r"-?\d+(?:\.\d+)?", gps_str or "")
+    if len(numbers) < 2:
+        return None
+    
+    lat, lon = float(numbers[0]), float(numbers[1])
+    if (lat == 0 and lon == 0) or abs(lat) > 90 or abs(lon) > 180:
+        return None
+    
+    return lat, lon
+
+def ffmpeg_metadata_args(item):
+    """FFmpeg -metadata arguments for capture time and location"""
+    args = ["-metadata", f"creation_time={item['timestamp'].strftime('%Y-%m-%dT%H:%M:%S.000000Z')}"]
+    
+    coords = parse_gps(item["gps"])
+    if coords:
+        args += ["-metadata", f"location={coords[0]:+08.4f}{coords[1]:+09.4f}/"]
+    
+    return args
+
+def _dms(value):
+    """Decimal degrees -> EXIF (degrees, minutes, seconds)"""
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 4)
+    return (float(degrees), float(minutes), seconds)
+
+def embed_jpeg_metadata(data, item):
+    """Return JPEG bytes with an EXIF block holding capture time and GPS (no re-encode)"""
+    from PIL import Image
+    from io import BytesIO
+    
+    if data[:2] != b"\xff\xd8":
+        return data
+    
+    try:
+        exif = Image.open(BytesIO(data)).getexif()
+    except Exception:
+        exif = Image.Exif()
+    
+    stamp = item["timestamp"].strftime("%Y:%m:%d %H:%M:%S")
+    exif[0x0132] = stamp  # DateTime
+    
+    exif_ifd = dict(exif.get_ifd(0x8769))
+    exif_ifd[0x9003] = stamp     # DateTimeOriginal
+    exif_ifd[0x9004] = stamp     # DateTimeDigitized
+    exif_ifd[0x9011] = "+00:00"  # OffsetTimeOriginal
+    exif[0x8769] = exif_ifd
+    
+    coords = parse_gps(item["gps"])
+    if coords:
+        lat, lon = coords
+        exif[0x8825] = {
+            0: b"\x02\x03\x00\x00",     # GPSVersionID
+            1: "N" if lat >= 0 else "S",
+            2: _dms(lat),
+            3: "E" if lon >= 0 else "W",
+            4: _dms(lon),
+        }
+    
+    exif_bytes = exif.tobytes()
+    if len(exif_bytes) > 65533:
+        return data
+    
+    # Walk the APPn segments, dropping any old Exif block
+    app0, others = [], []
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF and 0xE0 <= data[pos + 1] <= 0xEF:
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        segment = data[pos:pos + 2 + length]
+        if data[pos + 1] == 0xE0:
+            app0.append(segment)
+        elif not (data[pos + 1] == 0xE1 and segment[4:10] == b"Exif\x00\x00"):
+            others.append(segment)
+        pos += 2 + length
+    
+    app1 = b"\xff\xe1" + struct.pack(">H", len(exif_bytes) + 2) + exif_bytes
+    return b"".join([b"\xff\xd8", *app0, app1, *others, data[pos:]])
+
+def _iter_boxes(buf, start, end):
+    """Yield (offset, header_size, size, type) for MP4 boxes in buf[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack(">I4s", buf[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", buf[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield pos, header, size, box_type
+        pos += size
+
+def rewrite_mp4(data, item, metadata=True, faststart=True):
+    """
+    Return MP4 data as a list of chunks with creation times set and a ©xyz
+    location atom added (metadata), and/or with moov moved in front of mdat
+    (faststart). Only the moov box is rebuilt; media data is never copied.
+    """
+    view = memoryview(data)
+    top = list(_iter_boxes(view, 0, len(view)))
+    moov = next((b for b in top if b[3] == b"moov"), None)
+    if moov is None or moov[1] != 8:
+        return [data]
+    
+    moov_start, _, moov_size, _ = moov
+    moov_end = moov_start + moov_size
+    box = bytearray(view[moov_start:moov_end])
+    
+    # Creation/modification times in mvhd, tkhd and mdhd (version 0: 32-bit, version 1: 64-bit)
+    ts_mp4 = int(item["timestamp"].timestamp()) + MP4_EPOCH_OFFSET
+    stco_boxes = []
+    
+    def walk(start, end):
+        for pos, header, size, box_type in _iter_boxes(box, start, end):
+            body = pos + header
+            if metadata and box_type in (b"mvhd", b"tkhd", b"mdhd"):
+                if box[body] == 1:
+                    struct.pack_into(">QQ", box, body + 4, ts_mp4, ts_mp4)
+                else:
+                    struct.pack_into(">II", box, body + 4, ts_mp4 & 0xFFFFFFFF, ts_mp4 & 0xFFFFFFFF)
+            elif box_type in (b"stco", b"co64"):
+                stco_boxes.append((body, box_type))
+            elif box_type in MP4_CONTAINER_BOXES:
+                walk(body, pos + size)
+    
+    walk(8, len(box))
+    
+    # Append ©xyz to an existing moov/udta, or add a new udta at the end of moov
+    coords = parse_gps(item["gps"]) if metadata else None
+    added = b""
+    if coords and b"\xa9xyz" not in box:
+        location = f"{coords[0]:+08.4f}{coords[1]:+09.4f}/".encode()
+        xyz = struct.pack(">I4sHH", 12 + len(location), b"\xa9xyz", len(location), 0x15C7) + location
+        
+        udta = next((b for b in _iter_boxes(box, 8, len(box)) if b[3] == b"udta" and b[1] == 8), None)
+        if udta:
+            insert_at = udta[0] + udta[2]
+            struct.pack_into(">I", box, udta[0], udta[2] + len(xyz))
+            added = xyz
+        else:
+            insert_at = len(box)
+            added = struct.pack(">I4s", 8 + len(xyz), b"udta") + xyz
+    
+    # Faststart: media data between the first mdat and moov moves back by the new moov size
+    mdat = next((b for b in top if b[3] == b"mdat"), None)
+    move = (
+        faststart and mdat is not None and mdat[0] < moov_start
+        and len(view) + len(added) <= 0xFFFFFFFF  # keep 32-bit stco offsets valid
+    )
+    new_moov_size = moov_size + len(added)
+    
+    # Chunk offsets follow the media bytes to their new position
+    if added or move:
+        for body, box_type in stco_boxes:
+            count = struct.unpack_from(">I", box, body + 4)[0]
+            fmt, width = (">I", 4) if box_type == b"stco" else (">Q", 8)
+            for i in range(count):
+                entry = body + 8 + i * width
+                offset = struct.unpack_from(fmt, box, entry)[0]
+                if move and mdat[0] <= offset < moov_start:
+                    struct.pack_into(fmt, box, entry, offset + new_moov_size)
+                elif offset >= moov_end:
+                    struct.pack_into(fmt, box, entry, offset + len(added))
+    
+    if added:
+        box[insert_at:insert_at] = added
+        struct.pack_into(">I", box, 0, len(box))
+    
+    if move:
+        return [view[:mdat[0]], box, view[mdat[0]:moov_start], view[moov_end:]]
+    return [view[:moov_start], box, view[moov_end:]]
+
+@profiled
+def embed_metadata(data, item, ext):
+    """Embed capture time and GPS into downloaded bytes (and make MP4s faststart); returns a list of chunks to write"""
+    try:
+        if ext == ".jpg" and EMBED_METADATA:
+            return [embed_jpeg_metadata(data, item)]
+        if ext == ".mp4" and (EMBED_METADATA or FASTSTART):
+            return rewrite_mp4(data, item, metadata=EMBED_METADATA, faststart=FASTSTART)
+    except Exception as e:
+        print(f"\n  ⚠ Could not embed metadata for {item['media_id']}: {e}")
+    
+    return [data]
+
 # ============================================================
 # FFMPEG OVERLAY MERGE
 # ============================================================
-async def merge_overlay(main_path, overlay_path, output_path):
+async def run_ffmpeg(args):
+    """Run FFmpeg with the given arguments; raises with its error output on failure"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_PATH, *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"FFmpeg failed: {stderr.decode(errors='replace')[-500:]}")
+
+async def probe_duration(path):
+    """Container duration in seconds from FFmpeg's stream info, None if unknown"""
+    process = await asyncio.create_subprocess_exec(
+        FFMPEG_PATH, "-i", str(path),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", stderr.decode(errors="replace"))
+    if not match:
+        return None
+    h, m, sec = match.groups()
+    return int(h) * 3600 + int(m) * 60 + float(sec)
+
+encode_slots = asyncio.Semaphore(SEGMENT_WORKERS or os.cpu_count() or 1)  # shared by all videos
+overlay_stats = {"merged": 0, "blank_skipped": 0}  # for the summaries of both scripts
+SEGMENT_DURATION_TOLERANCE = 0.1  # seconds
+
+async def merge_overlay_segmented(main_path, overlay_path, output_path, item, duration):
+    """
+    Overlay a long video segment by segment in parallel, then join the segments
+    and the original audio with a stream copy. Returns False if the result's
+    duration doesn't match, so the caller can fall back to one pass.
+    """
+    seg_dir = main_path.parent / f"segments_{main_path.stem}"
+    seg_dir.mkdir(exist_ok=True)
+    
+    try:
+        # Cut the video stream at keyframes without re-encoding
+        await run_ffmpeg([
+            "-v", "error", "-i", str(main_path),
+            "-map", "0:v:0", "-c", "copy",
+            "-f", "segment", "-segment_time", str(SEGMENT_SECONDS), "-reset_timestamps", "1",
+            str(seg_dir / "src_%04d.mp4")
+        ])
+        sources = sorted(seg_dir.glob("src_*.mp4"))
+        if len(sources) < 2:
+            return False
+        
+        # Each encode gets a share of the cores instead of every one starting a thread per core
+        cores = os.cpu_count() or 1
+        threads = max(1, cores // min(len(sources), SEGMENT_WORKERS or cores))
+        
+        async def encode(src):
+            out = seg_dir / src.name.replace("src_", "enc_")
+            async with encode_slots:
+                await run_ffmpeg([
+                    "-v", "error", "-i", str(src), "-i", str(overlay_path),
+                    "-filter_complex", "overlay",
+                    "-c:v", "libx264", "-crf", "23", "-preset", "medium", "-threads", str(threads),
+                    "-an", str(out), "-y"
+                ])
+            return out
+        
+        encoded = await asyncio.gather(*(encode(src) for src in sources))
+        
+        concat_list = seg_dir / "concat.txt"
+        # Concat demuxer list; a ' inside a quoted path is written as '\''
+        concat_list.write_text(
+            "".join("file '" + p.as_posix().replace("'", "'\\''") + "'\n" for p in encoded),
+            encoding="utf-8"
+        )
+        
+        metadata = ffmpeg_metadata_args(item) if item and EMBED_METADATA else []
+        await run_ffmpeg([
+            "-v", "error", "-f", "concat", "-safe", "0", "-i", str(concat_list),
+            "-i", str(main_path),
+            "-map", "0:v", "-map", "1:a?", "-c", "copy",
+            *metadata,
+            *(["-movflags", "+faststart"] if FASTSTART else []),
+            str(output_path), "-y"
+        ])
+        
+        merged = await probe_duration(output_path)
+        return merged is not None and abs(merged - duration) <= SEGMENT_DURATION_TOLERANCE
+    
+    finally:
+        shutil.rmtree(seg_dir, ignore_errors=True)
+
+def overlay_is_blank(overlay_path):
+    """True if the overlay PNG has no pixel more opaque than BLANK_OVERLAY_MAX_ALPHA"""
+    from PIL import Image
+    
+    try:
+        with Image.open(overlay_path) as img:
+            if "A" not in img.getbands() and "transparency" not in img.info:
+                return False  # no alpha channel: every pixel is visible
+            alpha = img.getchannel("A") if "A" in img.getbands() else img.convert("RGBA").getchannel("A")
+            return alpha.getextrema()[1] <= BLANK_OVERLAY_MAX_ALPHA  # computed in C over all pixels
+    except Exception:
+        return False  # unreadable here: let FFmpeg decide
+
+async def merge_overlay(main_path, overlay_path, output_path, item=None):
     """Merge main file with overlay using FFmpeg"""
+    # A segmented merge that falls back to one pass is still a single merge on the progress bar
+    started = False
     try:
         # Determine if video or image
         is_video = main_path.suffix.lower() == ".mp4"
         
+        # Long videos: parallel segments first, one pass if that doesn't work out
+        if is_video and SEGMENT_PARALLEL_MERGE:
+            duration = await probe_duration(main_path)
+            if duration and duration >= SEGMENT_MIN_SECONDS:
+                progress.merges_started += 1
+                started = True
+                try:
+                    if await merge_overlay_segmented(main_path, overlay_path, output_path, item, duration):
+                        overlay_stats["merged"] += 1
+                        return True
+                    print(f"\n  ⚠ Segmented merge of {main_path.name} changed its length, merging in one pass")
+                except Exception as e:
+                    print(f"\n  ⚠ Segmented merge of {main_path.name} failed, merging in one pass: {e}")
+        
         if is_video:
+            metadata = ffmpeg_metadata_args(item) if item and EMBED_METADATA else []
             cmd = [
                 FFMPEG_PATH, "-i", str(main_path), "-i", str(overlay_path),
                 "-filter_complex", "overlay",
                 "-c:v", "libx264", "-crf", "23", "-preset", "medium",
                 "-c:a", "copy",
+                *metadata,
+                *(["-movflags", "+faststart"] if FASTSTART else []),
                 str(output_path),
                 "-y"  # overwrite
             ]
@@ -255,26 +2026,34 @@ async def merge_overlay(main_path, overlay_path, output_path):
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE
         )
+        if not started:
+            progress.merges_started += 1
+            started = True
         
         stdout, stderr = await process.communicate()
         
         if process.returncode != 0:
             raise Exception(f"FFmpeg failed: {stderr.decode()}")
         
+        overlay_stats["merged"] += 1
         return True
         
     except Exception as e:
         raise Exception(f"Overlay merge failed: {str(e)}")
+    finally:
+        if started:
+            progress.merges_done += 1
 
 # ============================================================
 # ZIP PROCESSING
 # ============================================================
-async def process_zip(zip_data, item, year_dir):
-    """Extract ZIP, merge overlay, and return final file path"""
+@profiled
+async def process_zip(zip_data, item, media_dir):
+    """Extract ZIP, merge overlay, and return (final file path, sha256)"""
     import zipfile
     from io import BytesIO
     
-    temp_folder = TEMP_DIR / f"zip_{item['media_id']}"
+    temp_folder = item["export"]["temp_dir"] / f"zip_{item['media_id']}"
     temp_folder.mkdir(parents=True, exist_ok=True)
     
     try:
@@ -297,32 +2076,162 @@ async def process_zip(zip_data, item, year_dir):
         # Determine output extension
         ext = main_path.suffix  # .mp4 or .jpg
         date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
-        output_path = year_dir / f"{date_str}_{item['media_id']}{ext}"
+        output_path = media_dir / f"{date_str}_{item['media_id']}{ext}"
+        disk_writer.ensure_dir(media_dir)
+        ts_unix = item["timestamp"].timestamp()
+        
+        # Nothing visible in the overlay: the main file is the final output, no FFmpeg
+        if SKIP_BLANK_OVERLAYS and await asyncio.to_thread(overlay_is_blank, overlay_path):
+            overlay_stats["blank_skipped"] += 1
+            digest = await disk_writer.write(output_path, embed_metadata(main_path.read_bytes(), item, ext.lower()), ts_unix)
+            return output_path, digest
         
         # Merge overlay
-        await merge_overlay(main_path, overlay_path, output_path)
+        await merge_overlay(main_path, overlay_path, output_path, item)
         
-        # Set timestamp
-        ts_unix = item["timestamp"].timestamp()
-        os.utime(output_path, (ts_unix, ts_unix))
+        # Set timestamp (FFmpeg does not write EXIF, so merged images get it here)
+        if ext.lower() == ".jpg" and EMBED_METADATA:
+            digest = await disk_writer.write(output_path, embed_metadata(output_path.read_bytes(), item, ".jpg"), ts_unix)
+        else:
+            digest = await disk_writer.finalize(output_path, ts_unix)
         
-        return output_path
+        return output_path, digest
         
     finally:
         # Cleanup temp folder
         if temp_folder.exists():
             shutil.rmtree(temp_folder, ignore_errors=True)
 
+# ============================================================
+# THUMBNAILS
+# ============================================================
+THUMB_CACHE_NAME = "thumbs_cache.json"
+
+def file_sha1(path):
+    """SHA-1 of a file using large sequential reads"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_thumbnail(src, dest, known_hash, size, ffmpeg_path):
+    """
+    Runs in a worker process. Returns (content_hash, generated); skips the
+    decode when the content hash matches the one the thumbnail was made from.
+    """
+    content_hash = file_sha1(src)
+    if content_hash == known_hash and dest.exists():
+        return content_hash, False
+    
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    
+    if src.suffix.lower() == ".mp4":
+        # Input-side seek jumps to a keyframe, so only one frame is decoded
+        for seek in ("1", "0"):
+            subprocess.run(
+                [ffmpeg_path, "-v", "error", "-ss", seek, "-i", str(src), "-frames:v", "1",
+                 "-vf", f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+                 "-q:v", "4", str(dest), "-y"],
+                capture_output=True
+            )
+            if dest.exists() and dest.stat().st_size > 0:
+                break
+        else:
+            raise Exception("FFmpeg produced no frame")
+    else:
+        from PIL import Image
+        with Image.open(src) as img:
+            # draft() makes the JPEG decoder downscale in the DCT domain (1/2, 1/4, 1/8)
+            img.draft("RGB", (size, size))
+            img.thumbnail((size, size))
+            img.convert("RGB").save(dest, "JPEG", quality=80)
+    
+    return content_hash, True
+
+class ThumbnailStage:
+    """Generates thumbnails on a process pool, cached by mtime/size and content hash"""
+    
+    def __init__(self):
+        self.pool = None
+        self.caches = {}  # library folder -> {relative path: [mtime_ns, size, hash]}
+        self.pending = []
+        self.stats = {"generated": 0, "cached": 0, "failed": 0}
+    
+    def submit(self, path, base_dir=None):
+        base_dir = base_dir or BASE_DIR
+        thumb_dir = base_dir / THUMB_DIR_NAME
+        
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=THUMB_WORKERS)
+        if base_dir not in self.caches:
+            cache_file = thumb_dir / THUMB_CACHE_NAME
+            self.caches[base_dir] = json.loads(cache_file.read_text(encoding="utf-8")) if cache_file.exists() else {}
+        
+        cache = self.caches[base_dir]
+        rel = path.relative_to(base_dir).as_posix()
+        dest = thumb_dir / path.relative_to(base_dir).with_suffix(".jpg")
+        st = path.stat()
+        entry = cache.get(rel)
+        
+        # Unchanged since last time: nothing to read at all
+        if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size and dest.exists():
+            self.stats["cached"] += 1
+            return
+        
+        future = asyncio.get_running_loop().run_in_executor(
+            self.pool, make_thumbnail, path, dest, entry[2] if entry else None, THUMB_SIZE, FFMPEG_PATH
+        )
+        self.pending.append((future, base_dir, rel, st))
+    
+    async def finish(self):
+        """Wait for outstanding thumbnails and save the cache"""
+        if self.pool is None:
+            return self.stats
+        
+        futures = {future: (base_dir, rel, st) for future, base_dir, rel, st in self.pending}
+        for future in tqdm(asyncio.as_completed(list(futures)), total=len(futures), desc="Thumbnails"):
+            try:
+                await future
+            except Exception:
+                pass
+        
+        for future, (base_dir, rel, st) in futures.items():
+            if future.exception():
+                self.stats["failed"] += 1
+                continue
+            content_hash, generated = future.result()
+            self.stats["generated" if generated else "cached"] += 1
+            self.caches[base_dir][rel] = [st.st_mtime_ns, st.st_size, content_hash]
+        
+        for base_dir, cache in self.caches.items():
+            thumb_dir = base_dir / THUMB_DIR_NAME
+            thumb_dir.mkdir(parents=True, exist_ok=True)
+            (thumb_dir / THUMB_CACHE_NAME).write_text(json.dumps(cache), encoding="utf-8")
+        self.pool.shutdown()
+        self.pool = None
+        self.pending = []
+        return self.stats
+
+thumbnails = ThumbnailStage()
+
 # ============================================================
 # DOWNLOAD FUNCTION WITH RETRY
 # ============================================================
+@profiled
 async def download_item(session, item, semaphore, stats):
     """Download single item with retry logic"""
     async with semaphore:
-        year_dir = BASE_DIR / str(item["year"])
-        year_dir.mkdir(parents=True, exist_ok=True)
+        export = item["export"]
+        media_dir = export["base_dir"] / media_subdir(item["timestamp"], item["media_id"])
+        ts_unix = item["timestamp"].timestamp()
         
         for attempt in range(1, MAX_RETRIES + 1):
+            # A retry can't help once the signed link has expired
+            if attempt > 1 and link_expired(item["expires"]):
+                await flag_expired(item, stats, attempt)
+                return
+            
             try:
                 # Download with timeout
                 async with session.get(
@@ -333,6 +2242,9 @@ async def download_item(session, item, semaphore, stats):
                     
                     if resp.status != 200:
                         error_msg = f"HTTP {resp.status}"
+                        # Refused after the expected expiry: the export is dead, not this one file
+                        if resp.status in [403, 410] and link_expired(expected_expiry(item)):
+                            error_msg = LINK_EXPIRED_ERROR
                         
                         # Retry transient errors
                         if resp.status in [500, 502, 504] and attempt < MAX_RETRIES:
@@ -342,43 +2254,57 @@ async def download_item(session, item, semaphore, stats):
                         else:
                             raise Exception(error_msg)
                     
-                    content_type = resp.headers.get("Content-Type", "").lower()
-                    data = await resp.read()
-                    
-                    # Route based on content type
-                    date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
-                    
-                    # IMAGE
-                    if "image/" in content_type:
-                        output_path = year_dir / f"{date_str}_{item['media_id']}.jpg"
-                        async with aiofiles.open(output_path, "wb") as f:
-                            await f.write(data)
-                        media_type = "Image"
-                    
-                    # VIDEO
-                    elif "video/mp4" in content_type:
-                        output_path = year_dir / f"{date_str}_{item['media_id']}.mp4"
-                        async with aiofiles.open(output_path, "wb") as f:
-                            await f.write(data)
-                        media_type = "Video"
-                    
-                    # ZIP (with overlay)
-                    elif "application/zip" in content_type:
-                        output_path = await process_zip(data, item, year_dir)
-                        media_type = "ZippedVideo"
-                    
-                    else:
-                        raise Exception(f"Unknown Content-Type: {content_type}")
-                    
-                    # Set file timestamp
-                    ts_unix = item["timestamp"].timestamp()
-                    os.utime(output_path, (ts_unix, ts_unix))
-                    
-                    # Log success
-                    await log_download(item, "success", filename=output_path.name, attempt=attempt)
-                    stats["success"] += 1
-                    
-                    return
+                    async with memory_budget.hold(estimate_memory(resp)):
+                        content_type, data = await hedger.read(session, item, resp)
+                        
+                        # Route based on content type (sniffed from the first bytes)
+                        date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
+                        
+                        # IMAGE
+                        if "image/" in content_type:
+                            ext = IMAGE_EXTENSIONS.get(content_type, ".jpg")
+                            output_path = media_dir / f"{date_str}_{item['media_id']}{ext}"
+                            bundled, digest = await save_output(item, output_path, embed_metadata(data, item, ext), ts_unix)
+                            media_type = "Image"
+                        
+                        # VIDEO
+                        elif "video/mp4" in content_type:
+                            output_path = media_dir / f"{date_str}_{item['media_id']}.mp4"
+                            bundled, digest = await save_output(item, output_path, embed_metadata(data, item, ".mp4"), ts_unix)
+                            media_type = "Video"
+                        
+                        # ZIP (with overlay)
+                        elif "application/zip" in content_type:
+                            # With S3, FFmpeg writes into _temp and the result is uploaded from there
+                            merge_dir = export["temp_dir"] / "merged" if S3_BUCKET else media_dir
+                            output_path, digest = await process_zip(data, item, merge_dir)
+                            media_type = "ZippedVideo"
+                            
+                            # Small merged results move from the loose file into the bundle
+                            bundled = False
+                            if S3_BUCKET:
+                                merged_path, output_path = output_path, media_dir / output_path.name
+                                try:
+                                    await object_store.upload(export["base_dir"], output_path, merged_path, ts_unix)
+                                finally:
+                                    merged_path.unlink()
+                            elif BUNDLE_MODE and output_path.stat().st_size <= BUNDLE_MAX_ITEM_MB * 1024 * 1024:
+                                bundled, digest = await save_output(item, output_path, [output_path.read_bytes()], ts_unix)
+                                output_path.unlink()
+                        
+                        else:
+                            raise Exception(f"Unknown Content-Type: {content_type}")
+                        
+                        await log_checksum(item, output_path, digest)
+                        
+                        if THUMBNAILS and not bundled and not S3_BUCKET:
+                            thumbnails.submit(output_path, export["base_dir"])
+                        
+                        # Log success
+                        await log_download(item, "success", filename=output_path.name, attempt=attempt)
+                        stats["success"] += 1
+                        
+                        return
             
             except asyncio.TimeoutError:
                 error_msg = "Timeout"
@@ -401,11 +2327,20 @@ async def download_item(session, item, semaphore, stats):
                     await asyncio.sleep(RETRY_BACKOFF[attempt - 1])
                     continue
                 else:
-                    error_type = "HTTP" if "HTTP" in error_msg else "ZIP" if "ZIP" in error_msg else "Unknown"
+                    error_type = "LinkExpired" if error_msg == LINK_EXPIRED_ERROR else "HTTP" if "HTTP" in error_msg else "ZIP" if "ZIP" in error_msg else "ErrorPage" if "Error page" in error_msg else "Unknown"
                     await log_download(item, "error", error_type, error_msg, attempt)
                     stats["failed"] += 1
+                    if error_type == "LinkExpired":
+                        stats["expired"] += 1
                     return
 
+async def flag_expired(item, stats, attempt=0):
+    """Log an item whose link has expired as failed, without requesting it"""
+    await log_error(item, LINK_EXPIRED_ERROR, attempt)
+    await log_download(item, "error", "LinkExpired", LINK_EXPIRED_ERROR, attempt)
+    stats["failed"] += 1
+    stats["expired"] += 1
+
 # ============================================================
 # MAIN DOWNLOAD ORCHESTRATOR
 # ============================================================
@@ -413,22 +2348,93 @@ async def download_all(items):
     """Download all items with progress tracking"""
     print(f"\nDownloading {len(items)} items...")
     
-    stats = {"success": 0, "failed": 0}
+    return (await download_exports([items]))[0]
+
+async def download_exports(item_lists):
+    """
+    Download one or more exports through one session and MAX_CONCURRENT workers.
+    Workers take turns between exports, so one big account can't starve the rest.
+    Returns one stats dict per export.
+    """
+    all_stats = [{"success": 0, "failed": 0, "expired": 0} for _ in item_lists]
+    
+    # Soonest-expiring links first; dead ones are only logged
+    scheduled = [schedule_by_expiry(items) for items in item_lists]
+    for stats, (_, dead) in zip(all_stats, scheduled):
+        for item in dead:
+            await flag_expired(item, stats)
+    
+    queues = [deque(live) for live, _ in scheduled]
+    turn = deque(i for i, q in enumerate(queues) if q)
     semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    pace = {"started": time.monotonic(), "next_check": time.monotonic() + EXPIRY_CHECK_SECONDS, "warned": 0}
+    
+    def next_item():
+        # Round-robin over exports that still have items waiting
+        while turn:
+            i = turn[0]
+            turn.rotate(-1)
+            if queues[i]:
+                return i, queues[i].popleft()
+            turn.remove(i)
+        return None, None
+    
+    def check_pace():
+        # Warn as soon as the current pace can't reach some links before they expire
+        now = time.monotonic()
+        pace["next_check"] = now + EXPIRY_CHECK_SECONDS
+        rate = progress.items_done / (now - pace["started"])
+        at_risk = links_at_risk(queues, rate, time.time()) if rate else 0
+        if at_risk > pace["warned"]:
+            pace["warned"] = at_risk
+            print(f"\n  ⚠ At {rate * 60:.0f} items/min about {at_risk} links may expire before they are reached. "
+                  f"Raise MAX_CONCURRENT, or request a new export if they fail as expired.")
+    
+    async def worker(session):
+        while True:
+            i, item = next_item()
+            if item is None:
+                return
+            if link_expired(item["expires"]):
+                await progress.track(flag_expired(item, all_stats[i]))
+                continue
+            await progress.track(download_item(session, item, semaphore, all_stats[i]))
+            if EXPIRY_SCHEDULING and time.monotonic() >= pace["next_check"]:
+                check_pace()
     
     async with aiohttp.ClientSession() as session:
-        tasks = [download_item(session, item, semaphore, stats) for item in items]
-        
-        for coro in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Downloading"):
-            await coro
+        progress.start(sum(len(q) for q in queues), "Downloading")
+        try:
+            await asyncio.gather(*(worker(session) for _ in range(MAX_CONCURRENT)))
+        finally:
+            await progress.stop()
     
-    return stats
+    await disk_writer.flush()
+    
+    if THUMBNAILS:
+        thumb_stats = await thumbnails.finish()
+        print(f"  Thumbnails: {thumb_stats['generated']} generated, {thumb_stats['cached']} cached, "
+              f"{thumb_stats['failed']} failed")
+    
+    return all_stats
 
 # ============================================================
 # SUMMARY REPORT
 # ============================================================
-def generate_summary(total_items, skipped, stats):
-    """Generate final summary report"""
+def run_stats_lines():
+    """Counters shared by every export in the run: memory budget, overlays, hedging"""
+    lines = [f"Peak in-flight memory: {memory_budget.peak / 1024 / 1024:.1f} MB of {MEMORY_BUDGET_MB} MB "
+             f"({memory_budget.waits} waits for budget)"]
+    if overlay_stats["merged"] or overlay_stats["blank_skipped"]:
+        lines.append(f"Overlays merged: {overlay_stats['merged']}, blank overlays skipped: "
+                     f"{overlay_stats['blank_skipped']} (FFmpeg encodes avoided)")
+    if HEDGE_REQUESTS:
+        lines.append(f"Hedged requests: {hedger.started} started, {hedger.won} won, "
+                     f"{hedger.wasted_bytes / 1024 / 1024:.1f} MB wasted")
+    return lines
+
+def generate_summary(total_items, skipped, stats, run_stats=True):
+    """Generate final summary report (run_stats=False leaves out the run-wide counters, for batch mode)"""
     summary = []
     summary.append("=" * 60)
     summary.append("SNAPCHAT MEMORIES DOWNLOAD SUMMARY")
@@ -438,6 +2444,10 @@ def generate_summary(total_items, skipped, stats):
     summary.append(f"Attempted to download: {total_items - skipped}")
     summary.append(f"Successfully downloaded: {stats['success']}")
     summary.append(f"Failed: {stats['failed']}")
+    if stats.get("expired"):
+        summary.append(f"  of which links expired: {stats['expired']} (request a new export from Snapchat for these)")
+    if run_stats:
+        summary.extend(run_stats_lines())
     summary.append("=" * 60)
     
     if stats['failed'] > 0:
@@ -447,7 +2457,10 @@ def generate_summary(total_items, skipped, stats):
         summary.append("\n✓ All downloads successful!")
     
     summary.append(f"\nLogs saved to: {LOG_DIR}")
-    summary.append(f"Media saved to: {BASE_DIR}/<year>/")
+    if S3_BUCKET:
+        summary.append(f"Media uploaded to: s3://{S3_BUCKET}/{object_store.key_prefix(BASE_DIR)}<year>/")
+    else:
+        summary.append(f"Media saved to: {BASE_DIR}/<year>/")
     
     summary_text = "\n".join(summary)
     
@@ -468,11 +2481,15 @@ async def main():
     
     setup_directories()
     
+    if PROFILE or "--profile" in sys.argv:
+        profiler.start()
+    
     # Parse and dedupe
     items = parse_html_and_dedupe(HTML_FILE)
     
     # Create manifest
     create_manifest(items)
+    build_index(items)
     
     # Check existing files
     to_download = check_existing_files(items)
@@ -487,8 +2504,53 @@ async def main():
     
     # Generate summary
     generate_summary(len(items), skipped, stats)
+    
+    if profiler.enabled:
+        await profiler.stop()
 
-if __name__ == "__main__":
+async def main_batch(export_dirs):
+    print("=" * 60)
+    print(f"SNAPCHAT MEMORIES BATCH DOWNLOADER ({len(export_dirs)} exports)")
+    print("=" * 60)
+    
+    # Prepare each export on its own: manifest, index and skip list stay per folder
+    exports = []
+    for export_dir in export_dirs:
+        activate_export(export_dir)
+        print(f"\n--- {BASE_DIR} ---")
+        setup_directories()
+        
+        items = parse_html_and_dedupe(HTML_FILE)
+        create_manifest(items)
+        build_index(items)
+        to_download = check_existing_files(items)
+        exports.append({"base_dir": BASE_DIR, "items": items, "to_download": to_download})
+    
+    if PROFILE or "--profile" in sys.argv:
+        profiler.start()
+    
+    # Download everything through the shared pool
+    total = sum(len(e["to_download"]) for e in exports)
+    print(f"\nDownloading {total} items from {len(exports)} exports...")
+    all_stats = await download_exports([e["to_download"] for e in exports])
+    
+    for export, stats in zip(exports, all_stats):
+        activate_export(export["base_dir"])
+        generate_summary(len(export["items"]), len(export["items"]) - len(export["to_download"]), stats, run_stats=False)
+    
+    # Memory, overlay and hedging counters cover the whole pool, so they're reported once for the batch
+    batch_text = "\n".join(["=" * 60, f"BATCH TOTALS ({len(exports)} exports)", "=" * 60, *run_stats_lines(), "=" * 60])
+    print("\n" + batch_text)
+    activate_export(exports[0]["base_dir"])
+    with open(SUMMARY_TXT, "a", encoding="utf-8") as f:
+        f.write("\n\n" + batch_text)
+    
+    # Batch-wide profile goes next to the first export's summary
+    if profiler.enabled:
+        await profiler.stop()
 
-    asyncio.run(main())
+if __name__ == "__main__":
+    
+    export_dirs = batch_dirs_from_args()
+    asyncio.run(main_batch(export_dirs) if export_dirs else main())
 
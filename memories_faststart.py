@@ -0,0 +1,140 @@
+# memories_faststart.py
+"""
+Snapchat Memories Faststart (optional)
+Moves the index (moov box) of every video in the library in front of the
+media data, so players and media servers can start streaming right away.
+FFmpeg only copies the streams, nothing is re-encoded. Videos that are
+already faststart are detected from the box headers alone, so re-running
+is cheap and safe.
+
+New downloads are saved this way already (FASTSTART in memories_download.py);
+this is for videos downloaded earlier.
+"""
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Remuxing only copies bytes, so it is mostly limited by the disk
+FASTSTART_WORKERS = None  # None = one per CPU core
+
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import os, struct, subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+# Shared settings (memories_download.py must sit next to this script)
+from memories_download import BASE_DIR, FFMPEG_PATH, TEMP_DIR, CHECKSUM_MANIFEST, file_sha256, append_checksum
+
+
+# ============================================================
+# BOX HEADERS
+# ============================================================
+def top_level_boxes(path):
+    """Types of the top-level MP4 boxes, reading only each box's header"""
+    types = []
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        pos = 0
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            header = f.read(16)
+            size, box_type = struct.unpack(">I4s", header[:8])
+            if size == 1:
+                size = struct.unpack(">Q", header[8:16])[0]
+            elif size == 0:
+                size = file_size - pos
+            if size < 8 or pos + size > file_size:
+                break  # truncated or not an MP4
+            types.append(box_type)
+            pos += size
+    return types
+
+def is_faststart(path):
+    """True if moov comes before mdat, None if the file doesn't look like an MP4"""
+    types = top_level_boxes(path)
+    if b"moov" not in types or b"mdat" not in types:
+        return None
+    return types.index(b"moov") < types.index(b"mdat")
+
+# ============================================================
+# REMUX ONE FILE (runs in a worker process)
+# ============================================================
+def remux_file(path):
+    """Returns (status, sha256 of the new file or None)"""
+    layout = is_faststart(path)
+    if layout is None:
+        return "failed: not a readable MP4", None
+    if layout:
+        return "already faststart", None
+    
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = TEMP_DIR / f"faststart_{path.stem}.mp4"
+    
+    cmd = [
+        FFMPEG_PATH, "-v", "error", "-i", str(path),
+        "-map", "0", "-map_metadata", "0", "-c", "copy",
+        "-movflags", "+faststart",
+        str(temp_path), "-y"
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    
+    try:
+        if result.returncode != 0:
+            return f"failed: {result.stderr.strip()[:200]}", None
+        
+        # A stream copy keeps the size within a few container bytes; anything else means lost data
+        original_size = path.stat().st_size
+        if not is_faststart(temp_path) or temp_path.stat().st_size < original_size * 0.98:
+            return "failed: remuxed file looks wrong", None
+        
+        # Keep the memory's capture time on the new file
+        st = path.stat()
+        os.utime(temp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(temp_path, path)
+        return "remuxed", file_sha256(path)
+    
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+# ============================================================
+# MAIN
+# ============================================================
+def main():
+    print("=" * 60)
+    print("SNAPCHAT MEMORIES FASTSTART")
+    print("=" * 60)
+    
+    videos = []
+    for year_dir in sorted(BASE_DIR.iterdir()):
+        if year_dir.is_dir() and year_dir.name.isdigit():
+            videos += sorted(year_dir.rglob("*.mp4"))
+    print(f"Videos in library: {len(videos)}")
+    
+    counts = {}
+    with ProcessPoolExecutor(max_workers=FASTSTART_WORKERS) as pool:
+        futures = {pool.submit(remux_file, path): path for path in videos}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Checking"):
+            path = futures[future]
+            try:
+                status, digest = future.result()
+            except Exception as e:
+                status, digest = f"failed: {e}", None
+            
+            if status.startswith("failed"):
+                print(f"\n  ✗ {path.name}: {status}")
+            counts[status.split(":")[0]] = counts.get(status.split(":")[0], 0) + 1
+            
+            # The bytes changed, so the download-time checksum is replaced
+            if digest and CHECKSUM_MANIFEST.parent.exists():
+                append_checksum(CHECKSUM_MANIFEST, path.relative_to(BASE_DIR).as_posix(), digest)
+    
+    print(f"\n  Remuxed to faststart: {counts.get('remuxed', 0)}")
+    print(f"  Already faststart: {counts.get('already faststart', 0)}")
+    print(f"  Failed: {counts.get('failed', 0)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# memories_migrate_layout.py
+"""
+Snapchat Memories Layout Migration (optional)
+Moves an existing library into the folder layout set by LIBRARY_LAYOUT in
+memories_download.py (year, month, day or hash folders). Files are only
+renamed, never copied, so it is fast even for huge libraries and needs no
+free space. Thumbnails, the checksum manifest, the search index and the
+download manifest (so memories_verify_recover.py looks in the new folders)
+are updated to match.
+Safe to stop and run again; files already in place are left alone.
+
+Run with --dry-run first to see what would move.
+"""
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import csv, json, os, sys
+from datetime import datetime
+from pathlib import PurePosixPath
+
+# Shared settings and helpers (memories_download.py must sit next to this script)
+from memories_download import (
+    BASE_DIR, LIBRARY_LAYOUT, CHECKSUM_MANIFEST, MANIFEST_CSV, THUMB_DIR_NAME, THUMB_CACHE_NAME, S3_BUCKET,
+    MemoryItem, media_subdir, parse_media_name, create_manifest, build_index,
+)
+
+
+# ============================================================
+# PLANNING
+# ============================================================
+def target_rel(rel):
+    """Where a library file belongs under LIBRARY_LAYOUT (relative, posix), or None if it isn't a memory"""
+    path = PurePosixPath(rel)
+    parsed = parse_media_name(path.stem)
+    if parsed is None or not path.parts[0].isdigit():
+        return None
+    return f"{media_subdir(*parsed)}/{path.name}"
+
+def plan_moves(root):
+    """(old, new) paths for files in root's year folders that aren't where the layout puts them"""
+    moves = []
+    if not root.exists():
+        return moves
+    
+    for year_dir in sorted(root.iterdir()):
+        if not year_dir.is_dir() or not year_dir.name.isdigit():
+            continue
+        for path in year_dir.rglob("*"):
+            if not path.is_file():
+                continue
+            rel = path.relative_to(root).as_posix()
+            new = target_rel(rel)
+            if new and new != rel:
+                moves.append((path, root / new))
+    return moves
+
+# ============================================================
+# MOVING
+# ============================================================
+def apply_moves(moves):
+    """Rename every planned file; returns (moved, conflicts)"""
+    moved, conflicts = 0, []
+    made_dirs = set()
+    
+    for old, new in moves:
+        if new.exists():
+            conflicts.append((old, new))
+            continue
+        if new.parent not in made_dirs:
+            new.parent.mkdir(parents=True, exist_ok=True)
+            made_dirs.add(new.parent)
+        os.rename(old, new)  # same filesystem, so no data is copied
+        moved += 1
+    
+    return moved, conflicts
+
+def remove_empty_dirs(root):
+    """Remove layout folders left empty, deepest first (year folders are kept)"""
+    if not root.exists():
+        return
+    for year_dir in root.iterdir():
+        if not year_dir.is_dir() or not year_dir.name.isdigit():
+            continue
+        for d in sorted((p for p in year_dir.rglob("*") if p.is_dir()), key=lambda p: len(p.parts), reverse=True):
+            try:
+                d.rmdir()
+            except OSError:
+                pass  # not empty
+
+# ============================================================
+# SIDE FILES (CHECKSUMS, MANIFEST + THUMBNAIL CACHE)
+# ============================================================
+def remap(rel):
+    """New relative path for a file that has moved, else the old one"""
+    new = target_rel(rel)
+    if new and new != rel and not (BASE_DIR / rel).exists() and (BASE_DIR / new).exists():
+        return new
+    return rel
+
+def update_checksum_manifest():
+    """Point checksum lines at the files' new paths (bundled items keep theirs)"""
+    if not CHECKSUM_MANIFEST.exists():
+        return 0
+    
+    changed = 0
+    lines = []
+    with open(CHECKSUM_MANIFEST, "r", encoding="utf-8") as f:
+        for line in f:
+            digest, _, rel = line.rstrip("\n").partition("  ")
+            new = remap(rel) if rel else rel
+            changed += new != rel
+            lines.append(f"{digest}  {new}\n" if rel else line)
+    
+    temp = CHECKSUM_MANIFEST.with_suffix(".tmp")
+    with open(temp, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    os.replace(temp, CHECKSUM_MANIFEST)
+    return changed
+
+def update_manifest():
+    """Rewrite manifest.csv and manifest.bin so each row's expected folder follows the new layout; returns the rows"""
+    if not MANIFEST_CSV.exists():
+        return []
+    
+    # The manifest has everything needed to rebuild itself, so the HTML file isn't required
+    with open(MANIFEST_CSV, "r", encoding="utf-8") as f:
+        items = [
+            MemoryItem(
+                row["original_url"],
+                int(datetime.fromisoformat(row["timestamp_utc"]).timestamp()),
+                row["gps"],
+                row["media_id"],
+                row["media_type_hint"]
+            )
+            for row in csv.DictReader(f)
+        ]
+    
+    create_manifest(items)
+    return items
+
+def update_thumb_cache():
+    """Re-key the thumbnail cache by the media files' new paths"""
+    cache_file = BASE_DIR / THUMB_DIR_NAME / THUMB_CACHE_NAME
+    if not cache_file.exists():
+        return
+    
+    cache = json.loads(cache_file.read_text(encoding="utf-8"))
+    cache = {remap(rel): entry for rel, entry in cache.items()}
+    cache_file.write_text(json.dumps(cache), encoding="utf-8")
+
+# ============================================================
+# MAIN
+# ============================================================
+def main():
+    dry_run = "--dry-run" in sys.argv
+    
+    print("=" * 60)
+    print(f"SNAPCHAT MEMORIES LAYOUT MIGRATION (to \"{LIBRARY_LAYOUT}\"){' - DRY RUN' if dry_run else ''}")
+    print("=" * 60)
+    
+    if S3_BUCKET:
+        print("S3_BUCKET is set: objects in a bucket can't be renamed, only copied. Nothing to do here.")
+        return
+    
+    thumb_root = BASE_DIR / THUMB_DIR_NAME
+    media_moves = plan_moves(BASE_DIR)
+    thumb_moves = plan_moves(thumb_root)
+    print(f"Files to move: {len(media_moves)} (plus {len(thumb_moves)} thumbnails)")
+    
+    if dry_run:
+        for old, new in media_moves[:20]:
+            print(f"  {old.relative_to(BASE_DIR)} -> {new.relative_to(BASE_DIR)}")
+        if len(media_moves) > 20:
+            print(f"  ... and {len(media_moves) - 20} more")
+        return
+    
+    moved, conflicts = apply_moves(media_moves)
+    apply_moves(thumb_moves)
+    remove_empty_dirs(BASE_DIR)
+    remove_empty_dirs(thumb_root)
+    
+    checksums_updated = update_checksum_manifest()
+    manifest_items = update_manifest()
+    update_thumb_cache()
+    
+    # Search index paths follow the layout too (built from the same rows, so no HTML file is needed)
+    if manifest_items:
+        build_index(manifest_items)
+    
+    print(f"\n  Moved: {moved}")
+    print(f"  Checksum entries updated: {checksums_updated}")
+    print(f"  Manifest rows rewritten: {len(manifest_items)}")
+    print(f"  Conflicts (target already exists, left in place): {len(conflicts)}")
+    for old, new in conflicts[:10]:
+        print(f"    - {old.relative_to(BASE_DIR)} (already at {new.relative_to(BASE_DIR)})")
+
+if __name__ == "__main__":
+    main()
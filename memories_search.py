@@ -0,0 +1,75 @@
+# memories_search.py
+"""
+Snapchat Memories Search
+Finds memories by date range and/or map area using the index that
+memories_download.py writes to _logs/library_index.bin. Media files are
+never opened, so lookups stay fast on very large libraries.
+
+Examples:
+    python memories_search.py --from 2019-06-01 --to 2019-07-01
+    python memories_search.py --bbox 40.49,-74.26,40.92,-73.70
+    python memories_search.py --from 2019-01-01 --bbox 40.49,-74.26,40.92,-73.70 --limit 20
+"""
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import argparse, math, time
+from datetime import datetime, timezone
+
+# Shared settings and helpers (memories_download.py must sit next to this script)
+from memories_download import BASE_DIR, INDEX_FILE, load_index, query_index
+
+
+# ============================================================
+# ARGUMENT PARSING
+# ============================================================
+def parse_date(value):
+    """YYYY-MM-DD or YYYY-MM-DD HH:MM:SS, in UTC"""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Invalid date: {value}")
+
+def parse_bbox(value):
+    """lat_min,lon_min,lat_max,lon_max"""
+    try:
+        lat_min, lon_min, lat_max, lon_max = (float(v) for v in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Bounding box must be lat_min,lon_min,lat_max,lon_max")
+    return lat_min, lon_min, lat_max, lon_max
+
+# ============================================================
+# MAIN
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="Search downloaded memories by time and location")
+    parser.add_argument("--from", dest="start", type=parse_date, help="start date (inclusive, UTC)")
+    parser.add_argument("--to", dest="end", type=parse_date, help="end date (exclusive, UTC)")
+    parser.add_argument("--bbox", type=parse_bbox, help="lat_min,lon_min,lat_max,lon_max")
+    parser.add_argument("--limit", type=int, default=0, help="print at most this many results")
+    parser.add_argument("--index", default=str(INDEX_FILE), help="index file to search")
+    args = parser.parse_args()
+    
+    started = time.perf_counter()
+    index = load_index(args.index)
+    loaded = time.perf_counter()
+    rows = query_index(index, args.start, args.end, args.bbox)
+    finished = time.perf_counter()
+    
+    shown = rows[:args.limit] if args.limit else rows
+    for r in shown:
+        taken = datetime.fromtimestamp(index["ts"][r], timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        place = "" if math.isnan(index["lat"][r]) else f"  ({index['lat'][r]:.4f}, {index['lon'][r]:.4f})"
+        print(f"{taken}  {BASE_DIR / index['names'][r]}.*{place}")
+    
+    if len(shown) < len(rows):
+        print(f"... and {len(rows) - len(shown)} more")
+    
+    print(f"\n{len(rows)} of {len(index['ts'])} memories matched "
+          f"(load {(loaded - started) * 1000:.1f} ms, query {(finished - loaded) * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# memories_thumbnails.py
+"""
+Snapchat Memories Thumbnails
+Generates gallery thumbnails for an existing library into BASE_DIR/_thumbs/.
+Uses the same settings and cache as memories_download.py (THUMB_SIZE,
+THUMB_WORKERS), so re-running only processes new or changed files.
+"""
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import asyncio
+
+# Shared settings and helpers (memories_download.py must sit next to this script)
+from memories_download import BASE_DIR, THUMB_DIR_NAME, IMAGE_EXTENSIONS, thumbnails
+
+# Every extension the downloader saves (plus .jpeg from older libraries)
+MEDIA_EXTENSIONS = {*IMAGE_EXTENSIONS.values(), ".jpeg", ".mp4"}
+
+
+# ============================================================
+# MAIN
+# ============================================================
+async def main():
+    print("=" * 60)
+    print("SNAPCHAT MEMORIES THUMBNAILS")
+    print("=" * 60)
+    
+    media = []
+    for year_dir in sorted(BASE_DIR.iterdir()):
+        if year_dir.is_dir() and year_dir.name.isdigit():
+            media += [p for p in year_dir.rglob("*") if p.suffix.lower() in MEDIA_EXTENSIONS]
+    
+    print(f"Found {len(media)} media files")
+    
+    for path in media:
+        thumbnails.submit(path)
+    
+    stats = await thumbnails.finish()
+    
+    print(f"\n  Generated: {stats['generated']}")
+    print(f"  Up to date: {stats['cached']}")
+    print(f"  Failed: {stats['failed']}")
+    print(f"\nThumbnails saved to: {BASE_DIR / THUMB_DIR_NAME}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
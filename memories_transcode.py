@@ -0,0 +1,189 @@
+# memories_transcode.py
+"""
+Snapchat Memories Transcoder (optional)
+Re-encodes the video library to HEVC or AV1 to save storage and backup
+bandwidth. Safe to stop and re-run: finished files are recorded in a
+journal, and files that are already efficient are left alone.
+"""
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# "hevc" (libx265, plays on most phones/TVs) or "av1" (libsvtav1, smaller but slower)
+TRANSCODE_CODEC = "hevc"
+TRANSCODE_CRF = {"hevc": 28, "av1": 35}
+
+# Each FFmpeg encode is already multi-threaded; a few at once keeps all cores busy
+TRANSCODE_WORKERS = 2
+
+# Skip videos already encoded with these codecs, or below this bitrate
+EFFICIENT_CODECS = {"hevc", "av1", "vp9"}
+MIN_BITRATE_KBPS = 1500
+
+# Only replace the original when the new file is at least this much smaller
+MIN_SAVING_RATIO = 0.10
+
+
+# ============================================================
+# IMPORTS/PACKAGES
+# ============================================================
+import csv, os, re, subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+
+# Shared settings (memories_download.py must sit next to this script)
+from memories_download import BASE_DIR, FFMPEG_PATH, LOG_DIR, TEMP_DIR, CHECKSUM_MANIFEST, file_sha256, append_checksum
+
+TRANSCODE_JOURNAL = LOG_DIR / "transcode_journal.csv"
+
+ENCODER_ARGS = {
+    "hevc": ["-c:v", "libx265", "-preset", "medium", "-tag:v", "hvc1"],
+    "av1": ["-c:v", "libsvtav1", "-preset", "8"],
+}
+
+
+# ============================================================
+# PROBING
+# ============================================================
+def probe_video(path):
+    """Return (codec, duration_seconds, bitrate_kbps) from FFmpeg's stream info"""
+    result = subprocess.run([FFMPEG_PATH, "-i", str(path)], capture_output=True, text=True)
+    
+    codec = re.search(r"Video: (\w+)", result.stderr)
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", result.stderr)
+    bitrate = re.search(r"bitrate: (\d+) kb/s", result.stderr)
+    
+    seconds = None
+    if duration:
+        h, m, s = duration.groups()
+        seconds = int(h) * 3600 + int(m) * 60 + float(s)
+    
+    return (
+        codec.group(1) if codec else None,
+        seconds,
+        int(bitrate.group(1)) if bitrate else None,
+    )
+
+# ============================================================
+# TRANSCODE ONE FILE (runs in a worker process)
+# ============================================================
+def transcode_file(path):
+    """Returns (status, original_bytes, final_bytes)"""
+    original_size = path.stat().st_size
+    codec, duration, bitrate = probe_video(path)
+    
+    if codec is None or duration is None:
+        return "failed: cannot probe", original_size, original_size
+    if codec in EFFICIENT_CODECS or (bitrate and bitrate < MIN_BITRATE_KBPS):
+        return "skipped", original_size, original_size
+    
+    TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    temp_path = TEMP_DIR / f"transcode_{path.stem}.mp4"
+    
+    cmd = [
+        FFMPEG_PATH, "-v", "error", "-i", str(path),
+        "-map", "0", "-map_metadata", "0",
+        *ENCODER_ARGS[TRANSCODE_CODEC], "-crf", str(TRANSCODE_CRF[TRANSCODE_CODEC]),
+        "-c:a", "copy", "-movflags", "+faststart",
+        str(temp_path), "-y"
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    
+    try:
+        if result.returncode != 0:
+            return f"failed: {result.stderr.strip()[:200]}", original_size, original_size
+        
+        # Never replace a file with one that lost part of the video
+        _, new_duration, _ = probe_video(temp_path)
+        if new_duration is None or abs(new_duration - duration) > 0.5:
+            return "failed: duration mismatch", original_size, original_size
+        
+        new_size = temp_path.stat().st_size
+        if new_size > original_size * (1 - MIN_SAVING_RATIO):
+            return "kept original", original_size, original_size
+        
+        # Keep the memory's capture time on the new file
+        st = path.stat()
+        os.utime(temp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(temp_path, path)
+        return "transcoded", original_size, new_size
+    
+    finally:
+        if temp_path.exists():
+            temp_path.unlink()
+
+# ============================================================
+# JOURNAL
+# ============================================================
+def load_journal():
+    """Finished files by relative path -> mtime_ns when they were finished"""
+    done = {}
+    if TRANSCODE_JOURNAL.exists():
+        with open(TRANSCODE_JOURNAL, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if not row["status"].startswith("failed"):
+                    done[row["file"]] = int(row["mtime_ns"])
+    return done
+
+# ============================================================
+# MAIN
+# ============================================================
+def main():
+    print("=" * 60)
+    print(f"SNAPCHAT MEMORIES TRANSCODE ({TRANSCODE_CODEC.upper()})")
+    print("=" * 60)
+    
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    done = load_journal()
+    
+    videos = []
+    for year_dir in sorted(BASE_DIR.iterdir()):
+        if year_dir.is_dir() and year_dir.name.isdigit():
+            videos += sorted(year_dir.rglob("*.mp4"))
+    
+    # Resume: skip anything finished earlier that hasn't changed since
+    todo = [v for v in videos if done.get(v.relative_to(BASE_DIR).as_posix()) != v.stat().st_mtime_ns]
+    print(f"Videos in library: {len(videos)}")
+    print(f"Already handled (journal): {len(videos) - len(todo)}")
+    print(f"To check: {len(todo)}")
+    
+    counts = {}
+    bytes_before = bytes_after = 0
+    new_journal = not TRANSCODE_JOURNAL.exists()
+    
+    with open(TRANSCODE_JOURNAL, "a", newline="", encoding="utf-8") as journal, \
+         ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS) as pool:
+        writer = csv.writer(journal)
+        if new_journal:
+            writer.writerow(["file", "mtime_ns", "status", "original_bytes", "final_bytes"])
+        
+        futures = {pool.submit(transcode_file, path): path for path in todo}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Transcoding"):
+            path = futures[future]
+            try:
+                status, before, after = future.result()
+            except Exception as e:
+                status, before, after = f"failed: {e}", 0, 0
+            
+            counts[status.split(":")[0]] = counts.get(status.split(":")[0], 0) + 1
+            bytes_before += before
+            bytes_after += after
+            
+            writer.writerow([path.relative_to(BASE_DIR).as_posix(), path.stat().st_mtime_ns, status, before, after])
+            journal.flush()
+            
+            # The bytes changed, so the download-time checksum is replaced
+            if status == "transcoded":
+                append_checksum(CHECKSUM_MANIFEST, path.relative_to(BASE_DIR).as_posix(), file_sha256(path))
+    
+    saved = bytes_before - bytes_after
+    print(f"\n  Transcoded: {counts.get('transcoded', 0)}")
+    print(f"  Already efficient (skipped): {counts.get('skipped', 0)}")
+    print(f"  Kept original (too little saving): {counts.get('kept original', 0)}")
+    print(f"  Failed: {counts.get('failed', 0)}")
+    print(f"  Space saved: {saved / 1024 / 1024:.1f} MB "
+          f"({saved / bytes_before * 100 if bytes_before else 0:.1f}% of checked videos)")
+    print(f"\nJournal: {TRANSCODE_JOURNAL}")
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,7 @@ LOG_DIR = BASE_DIR / "_logs"
 PARTIAL_SAVES_DIR = BASE_DIR / "partial_saves"
 
 MANIFEST_CSV = LOG_DIR / "manifest.csv"
+MANIFEST_BIN = LOG_DIR / "manifest.bin"
 DOWNLOAD_LOG_CSV = LOG_DIR / "download_log.csv"
 ERRORS_LOG = LOG_DIR / "errors.log"
 
@@ -41,14 +42,44 @@ RETRY_BACKOFF = [5, 10, 20]
 
 MIN_FILE_SIZE = 1024  # bytes
 
+# Checksums recorded by memories_download.py are rehashed in parallel to catch silent corruption.
+# CHECKSUM_ONLY_CHANGED (or --only-changed) skips files whose size, mtime, ctime and inode match
+# the last clean verify. That is much faster but can't see bit rot, which changes none of them,
+# so every file is rehashed by default (--full-hash forces it either way).
+VERIFY_CHECKSUMS = True
+CHECKSUM_ONLY_CHANGED = False
+HASH_WORKERS = None  # threads, None = one per CPU core
+
+CHECKSUM_MANIFEST = LOG_DIR / "manifest-sha256.txt"
+CHECKSUM_STATE = LOG_DIR / "checksum_verify_state.json"
+CHECKSUM_MISMATCHES_CSV = LOG_DIR / "checksum_mismatches.csv"
+
+# Nightly health check: `python memories_verify_recover.py --sample` deep-verifies (checksum +
+# decode) a random sample of files from each year and media type instead of the whole library,
+# gives an upper bound on the corruption rate, and fully checks any year/type whose sample fails.
+SAMPLE_SIZE = 2000           # files per run, split between years/types by how many files they hold
+SAMPLE_MIN_PER_STRATUM = 30  # so small years still get a useful sample
+SAMPLE_CONFIDENCE = 0.95
+SAMPLE_ESCALATE = True       # check every file of a year/type once its sample finds a bad one
+SAMPLE_REPORT = LOG_DIR / "sample_verify_report.txt"
+
 
 # ============================================================
 # IMPORTS/PACKAGES
 # ============================================================
-import asyncio, aiohttp, aiofiles, csv, os, subprocess, shutil
+import asyncio, aiohttp, csv, os, subprocess, shutil, hashlib, json, sys, time, math, random
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
 from datetime import datetime, timezone
-from collections import defaultdict
-from tqdm.asyncio import tqdm
+from collections import defaultdict, Counter
+
+# Shared helpers (memories_download.py must sit next to this script)
+from memories_download import EMBED_METADATA, FASTSTART, embed_metadata, ffmpeg_metadata_args, memory_budget, estimate_memory, disk_writer, progress, read_media, IMAGE_EXTENSIONS, load_bundle_index
+from memories_download import file_sha256, load_checksum_manifest, append_checksum, read_bundled
+from memories_download import BUNDLE_MODE, BUNDLE_MAX_ITEM_MB, save_output
+from memories_download import S3_BUCKET, object_store, media_subdir, parse_media_name, MemoryItem, ManifestColumns
+from memories_download import SKIP_BLANK_OVERLAYS, overlay_is_blank, overlay_stats
+from memories_download import EXPIRY_SCHEDULING, LINK_EXPIRED_ERROR, export_link_deadline, url_expiry, link_expiry, link_expired
 
 
 # ============================================================
@@ -63,6 +94,12 @@ def load_manifest():
         print("Please run memories_download.py first!")
         return []
     
+    # The columnar copy loads by memory-mapping; older downloads only wrote the CSV
+    if MANIFEST_BIN.exists() and MANIFEST_BIN.stat().st_mtime_ns >= MANIFEST_CSV.stat().st_mtime_ns:
+        items = ManifestColumns(MANIFEST_BIN)
+        print(f"  Loaded {len(items)} expected items")
+        return items
+    
     items = []
     with open(MANIFEST_CSV, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
@@ -76,80 +113,97 @@ def load_manifest():
 # SCAN DISK FOR ACTUAL FILES
 # ============================================================
 def scan_disk_files():
-    """Scan all year folders for actual files"""
+    """
+    Files in all year folders (and their layout subfolders), or the bucket's objects when
+    S3_BUCKET is set, as posix paths relative to BASE_DIR (e.g. "2019/2019-06-01_120000_ID.jpg").
+    Plain strings from os.scandir keep a million-file library quick to compare.
+    """
+    if S3_BUCKET:
+        return scan_bucket()
+    
     print("Scanning disk for files...")
     
     actual_files = []
     
-    for year_dir in BASE_DIR.iterdir():
-        if not year_dir.is_dir() or year_dir.name.startswith("_"):
-            continue
-        
-        if not year_dir.name.isdigit():
+    for year_dir in os.scandir(BASE_DIR):
+        if not year_dir.is_dir() or not year_dir.name.isdigit():
             continue
         
-        for file_path in year_dir.glob("*"):
-            if file_path.is_file():
-                actual_files.append(file_path)
+        folders = [year_dir.name]
+        while folders:
+            folder = folders.pop()
+            with os.scandir(BASE_DIR / folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        folders.append(f"{folder}/{entry.name}")
+                    elif entry.is_file():
+                        actual_files.append(f"{folder}/{entry.name}")
     
     print(f"  Found {len(actual_files)} files on disk")
     return actual_files
 
+def scan_bucket():
+    """Uploaded objects as <year>/.../<file> paths relative to BASE_DIR, like scan_disk_files()"""
+    print(f"Listing bucket {S3_BUCKET}...")
+    
+    actual_files = [
+        name for name in object_store.list_files(BASE_DIR)
+        if name.partition("/")[0].isdigit()
+    ]
+    
+    print(f"  Found {len(actual_files)} objects in the bucket")
+    return actual_files
+
+def scan_bundles():
+    """Load the offset indexes of any bundles (BUNDLE_MODE in memories_download.py)"""
+    bundled = load_bundle_index(BASE_DIR)
+    if bundled:
+        print(f"  Found {len(bundled)} items in bundle indexes")
+    return bundled
+
 # ============================================================
 # VERIFICATION: COMPARE MANIFEST VS DISK
 # ============================================================
-def verify_completeness(manifest_items, actual_files):
-    """Compare expected vs actual files"""
+def verify_completeness(manifest_items, actual_files, bundled=None):
+    """Compare expected vs actual files (and bundled items, if any)"""
     print("\nVerifying completeness...")
     
-    # Build expected files map
-    expected = {}
-    for item in manifest_items:
-        year = item["year"]
-        basename = item["expected_basename"]
-        expected[f"{year}/{basename}"] = item
-    
-    # Build actual files map (without extension)
-    actual = {}
-    for file_path in actual_files:
-        year = file_path.parent.name
-        basename = file_path.stem  # filename without extension
-        key = f"{year}/{basename}"
-        actual[key] = file_path
+    # Expected files as folder/basename, one per manifest row (manifests from before LIBRARY_LAYOUT only have the year)
+    if isinstance(manifest_items, ManifestColumns):
+        keys = manifest_items.column("expected_path")
+        media_ids = manifest_items.column("media_id") if bundled else None
+    else:
+        keys = [f"{item.get('expected_dir') or item['year']}/{item['expected_basename']}" for item in manifest_items]
+        media_ids = [item["media_id"] for item in manifest_items]
+    
+    # Actual files keyed the same way: folder relative to BASE_DIR + name without extension
+    # (layout folders never contain a dot, so the last one starts the extension)
+    actual = {rel.rpartition(".")[0] or rel: rel for rel in actual_files}
+    
+    # Both comparisons are set differences; rows are only built for what differs
+    expected = set(keys)
+    missing_keys = expected - actual.keys()
+    
+    # Bundled items are checked against their index entries by media ID, never listed or deleted here
+    bundled = bundled or {}
     
     # Find missing files
-    missing = []
-    for key, item in expected.items():
-        if key not in actual:
-            missing.append(item)
-    
-    # Find unexpected files
-    unexpected = []
-    for key, file_path in actual.items():
-        if key not in expected:
-            unexpected.append(file_path)
-    
-    # Find duplicates (same timestamp AND same media_id)
-    file_keys = {}  # key: "timestamp|media_id"
-    for file_path in actual_files:
-        try:
-            filename = file_path.stem
-            # Extract timestamp and media_id from filename: YYYY-MM-DD_HHMMSS_MEDIA-ID
-            parts = filename.split("_")
-            if len(parts) >= 3:
-                date_part = "_".join(parts[:2])  # YYYY-MM-DD_HHMMSS
-                media_id_part = "_".join(parts[2:]).replace("_NO-OVERLAY", "")  # Remove NO-OVERLAY suffix if present
-                key = f"{date_part}|{media_id_part}"
-                
-                if key not in file_keys:
-                    file_keys[key] = []
-                file_keys[key].append(file_path)
-        except:
-            continue
+    missing_rows = compress(range(len(keys)), map(missing_keys.__contains__, keys))
+    if media_ids is not None and bundled:
+        missing_rows = [row for row in missing_rows if media_ids[row] not in bundled]
+    if isinstance(manifest_items, ManifestColumns):
+        missing = manifest_items.select(missing_rows)
+    else:
+        missing = [manifest_items[row] for row in missing_rows]
+    
+    # Find unexpected files (paths relative to BASE_DIR, like the scan)
+    unexpected = sorted(actual[key] for key in actual.keys() - expected)
+    
+    duplicates = find_duplicates(actual, actual_files, unexpected)
     
-    duplicates = {k: v for k, v in file_keys.items() if len(v) > 1}
+    verified = len(expected) - len(missing)
     
-    print(f"  ✓ Successfully downloaded: {len(actual) - len(unexpected)}")
+    print(f"  ✓ Successfully downloaded: {verified}")
     print(f"  ✗ Missing files: {len(missing)}")
     print(f"  ? Unexpected files: {len(unexpected)}")
     print(f"  ⚠ True duplicates (same timestamp + media_id): {len(duplicates)}")
@@ -158,58 +212,87 @@ def verify_completeness(manifest_items, actual_files):
         "missing": missing,
         "unexpected": unexpected,
         "duplicates": duplicates,
-        "verified": len(actual) - len(unexpected)
+        "verified": verified
     }
 
+def find_duplicates(actual, actual_files, suspects):
+    """
+    True duplicates (same timestamp AND media_id), as "timestamp|media_id" -> relative paths.
+    A second copy is either an unexpected file (e.g. _NO-OVERLAY, or in another folder) or a
+    second extension under one name, so only those are grouped, not the whole library.
+    """
+    if len(actual) < len(actual_files):
+        counts = Counter(rel.rpartition(".")[0] or rel for rel in actual_files)
+        suspects = suspects + [rel for rel in actual_files if counts[rel.rpartition(".")[0] or rel] > 1]
+    
+    groups = {}
+    for rel in suspects:
+        # Filenames are YYYY-MM-DD_HHMMSS_MEDIA-ID, plus _NO-OVERLAY for partial saves
+        folder, _, name = (rel.rpartition(".")[0] or rel).rpartition("/")
+        parts = name.split("_", 2)
+        if len(parts) != 3:
+            continue
+        media_id = parts[2].replace("_NO-OVERLAY", "")
+        stem = f"{parts[0]}_{parts[1]}_{media_id}"
+        group = groups.setdefault(f"{parts[0]}_{parts[1]}|{media_id}", {rel})
+        group.add(rel)
+        
+        # The copy where the downloader put it: this folder, the year folder or the layout's folder
+        places = [key for key in (f"{folder}/{stem}", f"{folder.partition('/')[0]}/{stem}") if key in actual]
+        if not places and (parsed := parse_media_name(stem)):
+            places = [key for key in (f"{media_subdir(*parsed)}/{stem}",) if key in actual]
+        group.update(actual[key] for key in places)
+    
+    return {key: sorted(files) for key, files in groups.items() if len(files) > 1}
+
 # =================================================================
 # FILE INTEGRITY CHECKS --- currently disabled as it's quite slow
 # =================================================================
+def file_integrity_issue(file_path):
+    """What is wrong with one file (too small, image won't decode, video won't probe), or None"""
+    # Check file size
+    size = file_path.stat().st_size
+    if size < MIN_FILE_SIZE:
+        return f"Suspiciously small ({size} bytes)"
+    
+    # Check if image can be opened
+    if file_path.suffix.lower() in [".jpg", ".jpeg"]:
+        try:
+            from PIL import Image
+            with Image.open(file_path) as img:
+                img.verify()
+        except Exception as e:
+            return f"Corrupted image: {str(e)}"
+    
+    # Check if video has valid duration
+    elif file_path.suffix.lower() == ".mp4":
+        try:
+            result = subprocess.run(
+                [FFMPEG_PATH, "-i", str(file_path)],
+                capture_output=True,
+                text=True
+            )
+            if "Duration: 00:00:00" in result.stderr or "Invalid" in result.stderr:
+                return "Invalid or zero-duration video"
+        except Exception as e:
+            return f"Cannot probe video: {str(e)}"
+    
+    return None
+
 def check_file_integrity(actual_files):
     """Check for corrupted or suspicious files"""
     print("\nChecking file integrity...")
     
     issues = []
     
-    for file_path in actual_files:
-        # Check file size
-        size = file_path.stat().st_size
-        if size < MIN_FILE_SIZE:
+    for rel in actual_files:
+        file_path = BASE_DIR / rel
+        issue = file_integrity_issue(file_path)
+        if issue:
             issues.append({
                 "file": file_path,
-                "issue": f"Suspiciously small ({size} bytes)"
+                "issue": issue
             })
-            continue
-        
-        # Check if image can be opened
-        if file_path.suffix.lower() in [".jpg", ".jpeg"]:
-            try:
-                from PIL import Image
-                with Image.open(file_path) as img:
-                    img.verify()
-            except Exception as e:
-                issues.append({
-                    "file": file_path,
-                    "issue": f"Corrupted image: {str(e)}"
-                })
-        
-        # Check if video has valid duration
-        elif file_path.suffix.lower() == ".mp4":
-            try:
-                result = subprocess.run(
-                    [FFMPEG_PATH, "-i", str(file_path)],
-                    capture_output=True,
-                    text=True
-                )
-                if "Duration: 00:00:00" in result.stderr or "Invalid" in result.stderr:
-                    issues.append({
-                        "file": file_path,
-                        "issue": "Invalid or zero-duration video"
-                    })
-            except Exception as e:
-                issues.append({
-                    "file": file_path,
-                    "issue": f"Cannot probe video: {str(e)}"
-                })
     
     if issues:
         print(f"  ⚠ Found {len(issues)} files with integrity issues")
@@ -218,6 +301,256 @@ def check_file_integrity(actual_files):
     
     return issues
 
+# ============================================================
+# SAMPLING VERIFICATION (NIGHTLY HEALTH CHECK)
+# ============================================================
+def file_stratum(rel):
+    """(year, media type) a library file (path relative to BASE_DIR) is sampled under"""
+    suffix = os.path.splitext(rel)[1].lower()
+    kind = "video" if suffix == ".mp4" else "image" if suffix in IMAGE_EXTENSIONS.values() else "other"
+    return rel.partition("/")[0], kind
+
+def deep_verify(file_path, expected_sha256=None):
+    """Problem with one file (checksum, size, decode), or None if it is healthy"""
+    try:
+        if expected_sha256 and file_sha256(file_path) != expected_sha256:
+            return "Checksum mismatch"
+        return file_integrity_issue(file_path)
+    except OSError as e:
+        return f"Unreadable: {e}"
+
+def allocate_sample(strata, total):
+    """Files to draw per stratum: proportional to its size, at least SAMPLE_MIN_PER_STRATUM"""
+    population = sum(len(files) for files in strata.values())
+    return {
+        key: min(len(files), max(SAMPLE_MIN_PER_STRATUM, round(total * len(files) / population)))
+        for key, files in strata.items()
+    }
+
+def failure_rate_upper_bound(failures, checked, population, alpha):
+    """
+    One-sided Clopper-Pearson upper bound on a stratum's corruption rate
+    (exact rate if every file was checked)
+    """
+    if checked >= population:
+        return failures / population if population else 0.0
+    if failures >= checked:
+        return 1.0
+    
+    def at_most_failures(p):  # P(X <= failures) for X ~ Binomial(checked, p)
+        return sum(
+            math.exp(math.lgamma(checked + 1) - math.lgamma(i + 1) - math.lgamma(checked - i + 1)
+                     + i * math.log(p) + (checked - i) * math.log1p(-p))
+            for i in range(failures + 1)
+        )
+    
+    lo, hi = failures / checked, 1.0
+    for _ in range(60):
+        mid = (lo + hi) / 2
+        if at_most_failures(mid) > alpha:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+def sample_verify(actual_files):
+    """
+    Deep-verify a stratified random sample (year x media type) and bound the
+    corruption rate; strata whose sample finds a bad file are checked in full.
+    """
+    print("\nSampling verification...")
+    
+    strata = defaultdict(list)
+    for rel in actual_files:
+        strata[file_stratum(rel)].append(rel)
+    if not strata:
+        print("  No files to sample")
+        return None
+    
+    checksums = load_checksum_manifest(CHECKSUM_MANIFEST)
+    plan = allocate_sample(strata, SAMPLE_SIZE)
+    rng = random.Random()
+    results = {key: {"files": len(files), "checked": 0, "failures": [], "escalated": False} for key, files in strata.items()}
+    started = time.perf_counter()
+    
+    def check_all(picks):
+        """Deep-verify (stratum, relative path) pairs in parallel and record them"""
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS or os.cpu_count()) as pool:
+            issues = pool.map(lambda pick: deep_verify(BASE_DIR / pick[1], checksums.get(pick[1])), picks)
+            for (key, rel), issue in zip(picks, issues):
+                results[key]["checked"] += 1
+                if issue:
+                    results[key]["failures"].append((rel, issue))
+    
+    sampled = {key: rng.sample(files, plan[key]) for key, files in strata.items()}
+    check_all([(key, rel) for key, picks in sampled.items() for rel in picks])
+    print(f"  Sampled {sum(plan.values())} of {len(actual_files)} files from {len(strata)} year/type groups")
+    
+    # Escalate: a failure in a sample means that whole year/type gets checked
+    if SAMPLE_ESCALATE:
+        escalate = [key for key, r in results.items() if r["failures"] and r["checked"] < r["files"]]
+        for key in escalate:
+            results[key]["escalated"] = True
+            done = set(sampled[key])
+            rest = [(key, rel) for rel in strata[key] if rel not in done]
+            print(f"  ⚠ Failure in the {key[0]} {key[1]} sample: checking its other {len(rest)} files")
+            check_all(rest)
+    
+    # Bonferroni split of the error rate keeps the combined bound at SAMPLE_CONFIDENCE
+    alpha = (1 - SAMPLE_CONFIDENCE) / len(results)
+    population = sum(r["files"] for r in results.values())
+    estimate = upper = 0.0
+    for r in results.values():
+        weight = r["files"] / population
+        r["upper_bound"] = failure_rate_upper_bound(len(r["failures"]), r["checked"], r["files"], alpha)
+        estimate += weight * len(r["failures"]) / r["checked"]
+        upper += weight * r["upper_bound"]
+    
+    summary = {
+        "strata": results,
+        "checked": sum(r["checked"] for r in results.values()),
+        "files": population,
+        "failures": [f for r in results.values() for f in r["failures"]],
+        "estimate": estimate,
+        "upper_bound": min(upper, 1.0),
+        "elapsed": time.perf_counter() - started,
+    }
+    
+    print(f"  ✓ Checked: {summary['checked']} files in {summary['elapsed']:.0f}s")
+    print(f"  ✗ Failures: {len(summary['failures'])}")
+    print(f"  Corruption rate: {estimate * 100:.3f}% estimated, at most {summary['upper_bound'] * 100:.3f}% "
+          f"({SAMPLE_CONFIDENCE * 100:.0f}% confidence)")
+    
+    write_sample_report(summary)
+    return summary
+
+def write_sample_report(summary):
+    """Per year/type table plus every failure, in SAMPLE_REPORT"""
+    report = []
+    report.append("=" * 70)
+    report.append("SNAPCHAT MEMORIES SAMPLING VERIFICATION")
+    report.append("=" * 70)
+    report.append(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report.append(f"Checked {summary['checked']} of {summary['files']} files in {summary['elapsed']:.0f}s")
+    report.append(f"Corruption rate: {summary['estimate'] * 100:.3f}% estimated, "
+                  f"upper bound {summary['upper_bound'] * 100:.3f}% at {SAMPLE_CONFIDENCE * 100:.0f}% confidence")
+    report.append("")
+    
+    report.append(f"{'YEAR':<6} {'TYPE':<6} {'FILES':>9} {'CHECKED':>9} {'FAILED':>7} {'UPPER BOUND':>12}  ESCALATED")
+    report.append("-" * 70)
+    for (year, kind), r in sorted(summary["strata"].items()):
+        report.append(f"{year:<6} {kind:<6} {r['files']:>9} {r['checked']:>9} {len(r['failures']):>7} "
+                      f"{r['upper_bound'] * 100:>11.3f}%  {'yes' if r['escalated'] else ''}")
+    report.append("")
+    
+    if summary["failures"]:
+        report.append("FAILURES")
+        report.append("-" * 70)
+        for rel, issue in sorted(summary["failures"]):
+            report.append(f"  - {rel}: {issue}")
+        report.append("")
+    
+    with open(SAMPLE_REPORT, "w", encoding="utf-8") as f:
+        f.write("\n".join(report))
+    print(f"  Report: {SAMPLE_REPORT}")
+
+# ============================================================
+# CHECKSUM VERIFICATION
+# ============================================================
+def hash_entry(path, bundle_entry=None):
+    """SHA-256 of a loose file, or of one item inside a bundle"""
+    if bundle_entry is None:
+        return file_sha256(path)
+    return hashlib.sha256(read_bundled(bundle_entry)).hexdigest()
+
+def verify_checksums(bundled=None):
+    """Rehash the library against the checksum manifest using a thread pool"""
+    print("\nVerifying checksums...")
+    
+    checksums = load_checksum_manifest(CHECKSUM_MANIFEST)
+    if not checksums:
+        print(f"  No checksums recorded yet ({CHECKSUM_MANIFEST})")
+        return None
+    
+    by_name = {entry[1]: entry for entry in (bundled or {}).values()}
+    only_changed = (CHECKSUM_ONLY_CHANGED or "--only-changed" in sys.argv) and "--full-hash" not in sys.argv
+    
+    state = {}
+    if only_changed and CHECKSUM_STATE.exists():
+        with open(CHECKSUM_STATE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    
+    # Work out what to hash: a loose file, else its bundle entry. The stamp is the size, mtime,
+    # ctime and inode of whatever holds the bytes, so appending to a bundle rehashes its items
+    # and an in-place rewrite that restores the mtime (as the downloader does) still shows up.
+    missing, todo, unchanged, new_state = [], [], 0, {}
+    for rel, expected in checksums.items():
+        path = BASE_DIR / rel
+        entry = None
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            entry = by_name.get(rel)
+            if entry is None:
+                missing.append(rel)
+                continue
+            st = entry[0].stat()
+        
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino]
+        if state.get(rel) == stamp:
+            new_state[rel] = stamp
+            unchanged += 1
+        else:
+            todo.append((rel, path, entry, expected, stamp, st.st_size if entry is None else entry[3]))
+    
+    mismatched, unreadable = [], []
+    total_bytes = sum(t[5] for t in todo)
+    started = time.perf_counter()
+    
+    # Largest first so one big video doesn't finish alone at the end
+    todo.sort(key=lambda t: t[5], reverse=True)
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS or os.cpu_count()) as pool:
+        futures = [(t, pool.submit(hash_entry, t[1], t[2])) for t in todo]
+        for (rel, _, _, expected, stamp, _), future in futures:
+            try:
+                actual = future.result()
+            except OSError as e:
+                unreadable.append((rel, str(e)))
+                continue
+            
+            if actual == expected:
+                new_state[rel] = stamp
+            else:
+                mismatched.append((rel, expected, actual))
+    
+    elapsed = time.perf_counter() - started
+    
+    with open(CHECKSUM_STATE, "w", encoding="utf-8") as f:
+        json.dump(new_state, f)
+    
+    if mismatched or unreadable:
+        with open(CHECKSUM_MISMATCHES_CSV, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "expected_sha256", "actual_sha256"])
+            writer.writerows(mismatched)
+            writer.writerows((rel, "", f"unreadable: {error}") for rel, error in unreadable)
+    
+    rate = total_bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0
+    print(f"  Hashed: {len(todo)} ({total_bytes / 1024 / 1024:.1f} MB at {rate:.0f} MB/s)")
+    print(f"  Unchanged since last verify (skipped): {unchanged}")
+    print(f"  ✓ Checksums OK: {len(todo) - len(mismatched) - len(unreadable)}")
+    print(f"  ✗ Checksum mismatches: {len(mismatched)}")
+    print(f"  ✗ Unreadable: {len(unreadable)}")
+    print(f"  ✗ Recorded but missing: {len(missing)}")
+    
+    return {
+        "hashed": len(todo),
+        "unchanged": unchanged,
+        "mismatched": mismatched,
+        "unreadable": unreadable,
+        "missing": missing,
+    }
+
 # ============================================================
 # RETRY MISSING FILES
 # ============================================================
@@ -226,16 +559,21 @@ async def download_item_with_fallback(session, item, semaphore, stats):
     Download with fallback: if overlay merge fails, save main file only to partial_saves
     """
     import aiohttp
-    import aiofiles
     import shutil
     import zipfile
     from io import BytesIO
     
     async with semaphore:
-        year_dir = BASE_DIR / str(item["year"])
-        year_dir.mkdir(parents=True, exist_ok=True)
+        media_dir = BASE_DIR / media_subdir(item["timestamp"], item["media_id"])
+        ts_unix = item["timestamp"].timestamp()
         
         for attempt in range(1, MAX_TOTAL_RETRIES + 1):
+            # A retry can't help once the signed link has expired
+            if attempt > 1 and link_expired(item["expires"]):
+                stats["failed"] += 1
+                stats["expired"] += 1
+                return
+            
             try:
                 # Download with timeout
                 async with session.get(
@@ -254,142 +592,161 @@ async def download_item_with_fallback(session, item, semaphore, stats):
                         else:
                             raise Exception(error_msg)
                     
-                    content_type = resp.headers.get("Content-Type", "").lower()
-                    data = await resp.read()
-                    
-                    # Route based on content type
-                    date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
-                    
-                    # IMAGE
-                    if "image/" in content_type:
-                        output_path = year_dir / f"{date_str}_{item['media_id']}.jpg"
-                        async with aiofiles.open(output_path, "wb") as f:
-                            await f.write(data)
-                    
-                    # VIDEO
-                    elif "video/mp4" in content_type:
-                        output_path = year_dir / f"{date_str}_{item['media_id']}.mp4"
-                        async with aiofiles.open(output_path, "wb") as f:
-                            await f.write(data)
-                    
-                    # ZIP (with overlay) - WITH FALLBACK
-                    elif "application/zip" in content_type:
-                        try:
-                            # Try normal overlay merge using FFmpeg
-                            temp_folder = TEMP_DIR / f"zip_{item['media_id']}"
-                            temp_folder.mkdir(parents=True, exist_ok=True)
-                            
-                            try:
-                                # Extract ZIP
-                                with zipfile.ZipFile(BytesIO(data)) as z:
-                                    z.extractall(temp_folder)
-                                
-                                # Find main file (check both .mp4 and .jpg)
-                                main_files = list(temp_folder.glob("*-main.mp4")) + list(temp_folder.glob("*-main.jpg"))
-                                overlay_files = list(temp_folder.glob("*-overlay.png"))
-                                
-                                if not main_files:
-                                    raise Exception("ZIP missing -main.mp4 or -main.jpg")
-                                if not overlay_files:
-                                    raise Exception("ZIP missing -overlay.png")
-                                
-                                main_path = main_files[0]
-                                overlay_path = overlay_files[0]
-                                
-                                # Determine output extension
-                                ext = main_path.suffix  # .mp4 or .jpg
-                                output_path = year_dir / f"{date_str}_{item['media_id']}{ext}"
-                                
-                                # Merge overlay with FFmpeg
-                                is_video = main_path.suffix.lower() == ".mp4"
-                                
-                                if is_video:
-                                    cmd = [
-                                        FFMPEG_PATH, "-i", str(main_path), "-i", str(overlay_path),
-                                        "-filter_complex", "overlay",
-                                        "-c:v", "libx264", "-crf", "23", "-preset", "medium",
-                                        "-c:a", "copy",
-                                        str(output_path),
-                                        "-y"
-                                    ]
-                                else:
-                                    cmd = [
-                                        FFMPEG_PATH, "-i", str(main_path), "-i", str(overlay_path),
-                                        "-filter_complex", "overlay",
-                                        "-q:v", "2",
-                                        str(output_path),
-                                        "-y"
-                                    ]
-                                
-                                process = await asyncio.create_subprocess_exec(
-                                    *cmd,
-                                    stdout=asyncio.subprocess.PIPE,
-                                    stderr=asyncio.subprocess.PIPE
-                                )
-                                
-                                stdout, stderr = await process.communicate()
-                                
-                                if process.returncode != 0:
-                                    raise Exception(f"FFmpeg failed: {stderr.decode()}")
-                                
-                                # Success - set timestamp
-                                ts_unix = item["timestamp"].timestamp()
-                                os.utime(output_path, (ts_unix, ts_unix))
-                                
-                            finally:
-                                # Cleanup temp folder
-                                if temp_folder.exists():
-                                    shutil.rmtree(temp_folder, ignore_errors=True)
+                    async with memory_budget.hold(estimate_memory(resp)):
+                        content_type, data = await read_media(resp)
                         
-                        except Exception as merge_error:
-                            # FALLBACK: Save main file without overlay to partial_saves
-                            print(f"\n  ⚠ Overlay merge failed for {item['media_id']}, saving without overlay...")
-                            
-                            temp_folder = TEMP_DIR / f"zip_fallback_{item['media_id']}"
-                            temp_folder.mkdir(parents=True, exist_ok=True)
-                            
+                        # Route based on content type
+                        date_str = item["timestamp"].strftime("%Y-%m-%d_%H%M%S")
+                        
+                        # IMAGE
+                        if "image/" in content_type:
+                            ext = IMAGE_EXTENSIONS.get(content_type, ".jpg")
+                            output_path = media_dir / f"{date_str}_{item['media_id']}{ext}"
+                            _, digest = await save_output(item, output_path, embed_metadata(data, item, ext), ts_unix)
+                        
+                        # VIDEO
+                        elif "video/mp4" in content_type:
+                            output_path = media_dir / f"{date_str}_{item['media_id']}.mp4"
+                            _, digest = await save_output(item, output_path, embed_metadata(data, item, ".mp4"), ts_unix)
+                        
+                        # ZIP (with overlay) - WITH FALLBACK
+                        elif "application/zip" in content_type:
                             try:
-                                # Extract ZIP
-                                with zipfile.ZipFile(BytesIO(data)) as z:
-                                    z.extractall(temp_folder)
-                                
-                                # Find main file
-                                main_files = list(temp_folder.glob("*-main.mp4")) + list(temp_folder.glob("*-main.jpg"))
-                                
-                                if not main_files:
-                                    raise Exception("ZIP missing main file for fallback")
+                                # Try normal overlay merge using FFmpeg
+                                temp_folder = TEMP_DIR / f"zip_{item['media_id']}"
+                                temp_folder.mkdir(parents=True, exist_ok=True)
                                 
-                                main_path = main_files[0]
-                                ext = main_path.suffix
+                                try:
+                                    # Extract ZIP
+                                    with zipfile.ZipFile(BytesIO(data)) as z:
+                                        z.extractall(temp_folder)
+                                    
+                                    # Find main file (check both .mp4 and .jpg)
+                                    main_files = list(temp_folder.glob("*-main.mp4")) + list(temp_folder.glob("*-main.jpg"))
+                                    overlay_files = list(temp_folder.glob("*-overlay.png"))
+                                    
+                                    if not main_files:
+                                        raise Exception("ZIP missing -main.mp4 or -main.jpg")
+                                    if not overlay_files:
+                                        raise Exception("ZIP missing -overlay.png")
+                                    
+                                    main_path = main_files[0]
+                                    overlay_path = overlay_files[0]
+                                    
+                                    # Determine output extension
+                                    ext = main_path.suffix  # .mp4 or .jpg
+                                    output_path = media_dir / f"{date_str}_{item['media_id']}{ext}"
+                                    disk_writer.ensure_dir(media_dir)
+                                    
+                                    # Merge overlay with FFmpeg
+                                    is_video = main_path.suffix.lower() == ".mp4"
+                                    blank = SKIP_BLANK_OVERLAYS and await asyncio.to_thread(overlay_is_blank, overlay_path)
+                                    
+                                    if blank:
+                                        # Nothing visible to burn in: the main file is the final output
+                                        overlay_stats["blank_skipped"] += 1
+                                        cmd = None
+                                    elif is_video:
+                                        cmd = [
+                                            FFMPEG_PATH, "-i", str(main_path), "-i", str(overlay_path),
+                                            "-filter_complex", "overlay",
+                                            "-c:v", "libx264", "-crf", "23", "-preset", "medium",
+                                            "-c:a", "copy",
+                                            *(ffmpeg_metadata_args(item) if EMBED_METADATA else []),
+                                            *(["-movflags", "+faststart"] if FASTSTART else []),
+                                            str(output_path),
+                                            "-y"
+                                        ]
+                                    else:
+                                        cmd = [
+                                            FFMPEG_PATH, "-i", str(main_path), "-i", str(overlay_path),
+                                            "-filter_complex", "overlay",
+                                            "-q:v", "2",
+                                            str(output_path),
+                                            "-y"
+                                        ]
+                                    
+                                    if blank:
+                                        digest = await disk_writer.write(output_path, embed_metadata(main_path.read_bytes(), item, ext.lower()), ts_unix)
+                                    else:
+                                        process = await asyncio.create_subprocess_exec(
+                                            *cmd,
+                                            stdout=asyncio.subprocess.PIPE,
+                                            stderr=asyncio.subprocess.PIPE
+                                        )
+                                        progress.merges_started += 1
+                                        
+                                        stdout, stderr = await process.communicate()
+                                        progress.merges_done += 1
+                                        
+                                        if process.returncode != 0:
+                                            raise Exception(f"FFmpeg failed: {stderr.decode()}")
+                                        overlay_stats["merged"] += 1
+                                    
+                                    # Success - set timestamp (FFmpeg does not write EXIF, so merged images get it here)
+                                    if not is_video and not blank and EMBED_METADATA:
+                                        digest = await disk_writer.write(output_path, embed_metadata(output_path.read_bytes(), item, ".jpg"), ts_unix)
+                                    elif not blank:
+                                        digest = await disk_writer.finalize(output_path, ts_unix)
+                                    
+                                    # Small merged results move from the loose file into the bundle, like the downloader
+                                    if BUNDLE_MODE and not S3_BUCKET and output_path.stat().st_size <= BUNDLE_MAX_ITEM_MB * 1024 * 1024:
+                                        _, digest = await save_output(item, output_path, [output_path.read_bytes()], ts_unix)
+                                        output_path.unlink()
+                                    elif S3_BUCKET:
+                                        try:
+                                            await object_store.upload(BASE_DIR, output_path, output_path, ts_unix)
+                                        finally:
+                                            output_path.unlink()
                                 
-                                # Save to partial_saves folder instead
-                                PARTIAL_SAVES_DIR.mkdir(parents=True, exist_ok=True)
-                                output_path = PARTIAL_SAVES_DIR / f"{date_str}_{item['media_id']}_NO-OVERLAY{ext}"
-                                
-                                # Copy main file
-                                shutil.copy(main_path, output_path)
+                                finally:
+                                    # Cleanup temp folder
+                                    if temp_folder.exists():
+                                        shutil.rmtree(temp_folder, ignore_errors=True)
+                            
+                            except Exception as merge_error:
+                                # FALLBACK: Save main file without overlay to partial_saves
+                                print(f"\n  ⚠ Overlay merge failed for {item['media_id']}, saving without overlay...")
                                 
-                                # Set timestamp
-                                ts_unix = item["timestamp"].timestamp()
-                                os.utime(output_path, (ts_unix, ts_unix))
+                                temp_folder = TEMP_DIR / f"zip_fallback_{item['media_id']}"
+                                temp_folder.mkdir(parents=True, exist_ok=True)
                                 
-                                stats["partial"] += 1
-                                return
+                                try:
+                                    # Extract ZIP
+                                    with zipfile.ZipFile(BytesIO(data)) as z:
+                                        z.extractall(temp_folder)
+                                    
+                                    # Find main file
+                                    main_files = list(temp_folder.glob("*-main.mp4")) + list(temp_folder.glob("*-main.jpg"))
+                                    
+                                    if not main_files:
+                                        raise Exception("ZIP missing main file for fallback")
+                                    
+                                    main_path = main_files[0]
+                                    ext = main_path.suffix
+                                    
+                                    # Save to partial_saves folder instead
+                                    PARTIAL_SAVES_DIR.mkdir(parents=True, exist_ok=True)
+                                    output_path = PARTIAL_SAVES_DIR / f"{date_str}_{item['media_id']}_NO-OVERLAY{ext}"
+                                    
+                                    # Copy main file (and set its timestamp)
+                                    await disk_writer.write(output_path, embed_metadata(main_path.read_bytes(), item, ext.lower()), ts_unix)
+                                    
+                                    stats["partial"] += 1
+                                    return
                                 
-                            finally:
-                                # Cleanup temp folder
-                                if temp_folder.exists():
-                                    shutil.rmtree(temp_folder, ignore_errors=True)
-                    
-                    else:
-                        raise Exception(f"Unknown Content-Type: {content_type}")
-                    
-                    # Set file timestamp for non-zip files
-                    ts_unix = item["timestamp"].timestamp()
-                    os.utime(output_path, (ts_unix, ts_unix))
-                    
-                    stats["success"] += 1
-                    return
+                                finally:
+                                    # Cleanup temp folder
+                                    if temp_folder.exists():
+                                        shutil.rmtree(temp_folder, ignore_errors=True)
+                        
+                        else:
+                            raise Exception(f"Unknown Content-Type: {content_type}")
+                        
+                        append_checksum(CHECKSUM_MANIFEST, output_path.relative_to(BASE_DIR).as_posix(), digest)
+                        
+                        stats["success"] += 1
+                        return
             
             except asyncio.TimeoutError:
                 if attempt < MAX_TOTAL_RETRIES:
@@ -426,46 +783,67 @@ async def retry_missing_files(missing_items):
             for row in reader:
                 previous_attempts[row["media_id"]] = int(row.get("attempt_number", 0))
     
-    # Filter items that haven't exceeded max retries
+    # Filter items that haven't exceeded max retries or whose links are dead
     to_retry = []
     unrecoverable = []
+    expired = []
+    deadline = export_link_deadline(BASE_DIR / "memories_history.html")
     
     for item in missing_items:
         attempts = previous_attempts.get(item["media_id"], 0)
-        if attempts >= MAX_TOTAL_RETRIES:
+        # Only the link's own expiry skips it; the export deadline just orders the retries
+        expires = url_expiry(item["original_url"]) if EXPIRY_SCHEDULING else None
+        if link_expired(expires):
+            expired.append(item)
+        elif attempts >= MAX_TOTAL_RETRIES:
             unrecoverable.append(item)
         else:
-            to_retry.append(item)
+            to_retry.append((expires, item))
     
     if unrecoverable:
         print(f"  ⚠ {len(unrecoverable)} items already exceeded max retries (marked unrecoverable)")
+    if expired:
+        print(f"  ⚠ {len(expired)} items have expired links and were not retried. {LINK_EXPIRED_ERROR}.")
     
     if not to_retry:
-        return {"success": 0, "failed": len(unrecoverable), "partial": 0}
+        return {"success": 0, "failed": len(unrecoverable) + len(expired), "partial": 0, "expired": len(expired)}
     
-    stats = {"success": 0, "failed": 0, "partial": 0}
+    # Soonest-expiring links first
+    to_retry.sort(key=lambda pair: link_expiry(pair[1]["original_url"], deadline) or math.inf)
+    
+    stats = {"success": 0, "failed": 0, "partial": 0, "expired": len(expired)}
     semaphore = asyncio.Semaphore(MAX_CONCURRENT)
     
     async with aiohttp.ClientSession() as session:
         tasks = []
-        for item in to_retry:
+        for expires, item in to_retry:
             # Convert manifest item back to download item format
-            download_item_data = {
-                "url": item["original_url"],
-                "timestamp": datetime.fromisoformat(item["timestamp_utc"]),
-                "year": int(item["year"]),
-                "gps": item["gps"],
-                "media_id": item["media_id"],
-                "media_type_hint": item["media_type_hint"]
-            }
+            download_item_data = MemoryItem(
+                item["original_url"],
+                int(datetime.fromisoformat(item["timestamp_utc"]).timestamp()),
+                item["gps"],
+                item["media_id"],
+                item["media_type_hint"],
+                export={"base_dir": BASE_DIR},  # where save_output puts loose files, bundles and uploads
+                expires=expires
+            )
             tasks.append(download_item_with_fallback(session, download_item_data, semaphore, stats))
         
-        for coro in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Retrying"):
-            await coro
+        progress.start(len(tasks), "Retrying")
+        try:
+            await asyncio.gather(*(progress.track(task) for task in tasks))
+        finally:
+            await progress.stop()
+    
+    await disk_writer.flush()
     
     print(f"  ✓ Successfully recovered: {stats['success']}")
     print(f"  ⚠ Partial saves (without overlay): {stats['partial']}")
+    if overlay_stats["blank_skipped"]:
+        print(f"  Blank overlays skipped (FFmpeg encodes avoided): {overlay_stats['blank_skipped']}")
     print(f"  ✗ Still failed: {stats['failed']}")
+    if stats["expired"]:
+        print(f"  ✗ Links expired (need a new export): {stats['expired']}")
     
     return stats
 
@@ -488,7 +866,7 @@ def resolve_duplicates(duplicates, auto_delete=False):
         
         # Compare file sizes
         file_info = []
-        for f in files:
+        for f in (BASE_DIR / rel for rel in files):
             size = f.stat().st_size
             print(f"    - {f.name} ({size} bytes)")
             file_info.append({"path": f, "size": size})
@@ -543,11 +921,12 @@ def cleanup_unexpected(unexpected_files, auto_delete=False):
     
     print(f"\nFound {len(unexpected_files)} unexpected files:")
     
-    for f in unexpected_files:
-        print(f"  - {f.relative_to(BASE_DIR)}")
+    for rel in unexpected_files:
+        print(f"  - {rel}")
     
     if auto_delete:
-        for f in unexpected_files:
+        for rel in unexpected_files:
+            f = BASE_DIR / rel
             print(f"  Deleting: {f.name}")
             f.unlink()
         print(f"  ✓ Deleted {len(unexpected_files)} unexpected files")
@@ -574,6 +953,9 @@ def generate_unrecoverable_report(missing_items, errors_log_path):
                 if match:
                     last_errors[match.group(1)] = match.group(2).strip()
     
+    # Dead links only need a fresh export, whatever their last error was
+    expired = 0
+    
     with open(UNRECOVERABLE_CSV, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow([
@@ -586,21 +968,29 @@ def generate_unrecoverable_report(missing_items, errors_log_path):
         ])
         
         for item in missing_items:
+            last_error = last_errors.get(item["media_id"], "Unknown error")
+            if EXPIRY_SCHEDULING and link_expired(url_expiry(item["original_url"])):
+                last_error = LINK_EXPIRED_ERROR
+            if last_error == LINK_EXPIRED_ERROR:
+                expired += 1
+            
             writer.writerow([
                 item["timestamp_utc"],
                 item["year"],
                 item["media_id"],
                 item["gps"],
                 item["original_url"],
-                last_errors.get(item["media_id"], "Unknown error")
+                last_error
             ])
     
     print(f"  ✗ {len(missing_items)} unrecoverable items logged to: {UNRECOVERABLE_CSV}")
+    if expired:
+        print(f"    {expired} of them only have expired links: request a new export from Snapchat to get them")
 
 # ============================================================
 # FINAL REPORT
 # ============================================================
-def generate_final_report(manifest_count, verification_results, retry_stats): #, integrity_issues):
+def generate_final_report(manifest_count, verification_results, retry_stats, checksum_results=None): #, integrity_issues):
     """Generate comprehensive final report"""
     report = []
     report.append("=" * 70)
@@ -627,6 +1017,22 @@ def generate_final_report(manifest_count, verification_results, retry_stats): #,
         report.append("-" * 70)
         report.append(f"Successfully recovered: {retry_stats['success']}")
         report.append(f"Failed to recover: {retry_stats['failed']}")
+        if retry_stats.get("expired"):
+            report.append(f"Links expired (request a new export from Snapchat): {retry_stats['expired']}")
+        report.append("")
+    
+    if checksum_results:
+        report.append("CHECKSUMS")
+        report.append("-" * 70)
+        report.append(f"Rehashed: {checksum_results['hashed']}")
+        report.append(f"Unchanged since last verify: {checksum_results['unchanged']}")
+        report.append(f"Mismatches: {len(checksum_results['mismatched'])}")
+        for rel, _, _ in checksum_results["mismatched"][:10]:
+            report.append(f"  - {rel}")
+        if len(checksum_results["mismatched"]) > 10:
+            report.append(f"  ... and {len(checksum_results['mismatched']) - 10} more")
+        report.append(f"Unreadable: {len(checksum_results['unreadable'])}")
+        report.append(f"Recorded but missing: {len(checksum_results['missing'])}")
         report.append("")
     
     # if integrity_issues:
@@ -663,6 +1069,8 @@ def generate_final_report(manifest_count, verification_results, retry_stats): #,
         report.append(f"Unrecoverable items: {UNRECOVERABLE_CSV}")
     if verification_results['duplicates']:
         report.append(f"Duplicates found: {DUPLICATES_CSV}")
+    if checksum_results and (checksum_results["mismatched"] or checksum_results["unreadable"]):
+        report.append(f"Checksum mismatches: {CHECKSUM_MISMATCHES_CSV}")
     report.append("")
     report.append("=" * 70)
     
@@ -683,6 +1091,16 @@ async def main():
     print("SNAPCHAT MEMORIES VERIFICATION & RECOVERY")
     print("=" * 70)
     
+    # Nightly health check: a deep-verified sample only, no retries or prompts
+    if "--sample" in sys.argv:
+        if S3_BUCKET:
+            print("Sampling verification needs the files on disk; S3_BUCKET is set.")
+            return
+        summary = sample_verify(scan_disk_files())
+        if summary and summary["failures"]:
+            sys.exit(1)
+        return
+    
     # Load manifest
     manifest_items = load_manifest()
     if not manifest_items:
@@ -690,9 +1108,10 @@ async def main():
     
     # Scan disk
     actual_files = scan_disk_files()
+    bundled = scan_bundles()
     
     # Verify completeness
-    verification_results = verify_completeness(manifest_items, actual_files)
+    verification_results = verify_completeness(manifest_items, actual_files, bundled)
     
     # Check integrity
     #integrity_issues = check_file_integrity(actual_files)
@@ -702,20 +1121,25 @@ async def main():
     
     # After retries, check what's still missing
     actual_files_after = scan_disk_files()
-    verification_after = verify_completeness(manifest_items, actual_files_after)
+    verification_after = verify_completeness(manifest_items, actual_files_after, bundled)
+    
+    # Rehash against the checksums recorded at download time (needs local files)
+    checksum_results = verify_checksums(bundled) if VERIFY_CHECKSUMS and not S3_BUCKET else None
     
     # Generate unrecoverable report
     generate_unrecoverable_report(verification_after["missing"], ERRORS_LOG)
     
     # Handle duplicates (requires user confirmation)
     print("\n" + "=" * 70)
-    if verification_after["duplicates"]:
+    if S3_BUCKET and (verification_after["duplicates"] or verification_after["unexpected"]):
+        print("Duplicates and unexpected objects are listed above; nothing is deleted from the bucket.")
+    elif verification_after["duplicates"]:
         response = input(f"Found {len(verification_after['duplicates'])} duplicate groups. Delete duplicates? (yes/no): ")
         auto_delete = response.lower() == "yes"
         resolve_duplicates(verification_after["duplicates"], auto_delete=auto_delete)
     
     # Handle unexpected files (requires user confirmation)
-    if verification_after["unexpected"]:
+    if verification_after["unexpected"] and not S3_BUCKET:
         response = input(f"Found {len(verification_after['unexpected'])} unexpected files. Delete them? (yes/no): ")
         auto_delete = response.lower() == "yes"
         cleanup_unexpected(verification_after["unexpected"], auto_delete=auto_delete)
@@ -724,7 +1148,8 @@ async def main():
     generate_final_report(
         len(manifest_items),
         verification_after,
-        retry_stats#,
+        retry_stats,
+        checksum_results#,
         #integrity_issues
     )
     
@@ -732,6 +1157,6 @@ async def main():
 
 if __name__ == "__main__":
     import re  # needed for unrecoverable report
-
+    
     asyncio.run(main())
 
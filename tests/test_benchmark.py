@@ -0,0 +1,60 @@
+# tests/test_benchmark.py
+"""
+Smoke test for memories_benchmark.py: every layout, bundles and the
+in-memory listing run end to end on a tiny export, so the benchmark
+can't silently break when the scripts it times change.
+Run with: python -m pytest tests
+"""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import memories_benchmark as mb
+import memories_download as md
+import memories_verify_recover as vr
+
+# Module-level settings the benchmark repoints (md.activate_export() and point_scripts_at())
+MD_SETTINGS = ["BASE_DIR", "TEMP_DIR", "LOG_DIR", "HTML_FILE", "MANIFEST_CSV", "MANIFEST_BIN", "DOWNLOAD_LOG_CSV",
+               "ERRORS_LOG", "SUMMARY_TXT", "INDEX_FILE", "CHECKSUM_MANIFEST", "PROFILE_FOLDED", "PROFILE_REPORT",
+               "S3_BUCKET", "LIBRARY_LAYOUT"]
+VR_SETTINGS = ["BASE_DIR", "TEMP_DIR", "LOG_DIR", "MANIFEST_CSV", "MANIFEST_BIN", "DUPLICATES_CSV"]
+
+
+@pytest.fixture(autouse=True)
+def scratch(tmp_path, monkeypatch):
+    """Generate datasets under tmp_path and put every setting back afterwards"""
+    monkeypatch.setattr(mb, "DATA_ROOT", tmp_path)
+    monkeypatch.setattr(mb, "REPEAT", mb.REPEAT)
+    for name in MD_SETTINGS:
+        monkeypatch.setattr(md, name, getattr(md, name))
+    for name in VR_SETTINGS:
+        monkeypatch.setattr(vr, name, getattr(vr, name))
+
+
+def test_every_layout_bundled_and_listed(tmp_path, monkeypatch):
+    saved = tmp_path / "results.json"
+    monkeypatch.setattr(sys, "argv", ["memories_benchmark.py", "--rows", "300", "--layout", "year", "hash", "--bundle",
+                                      "--listed-rows", "300", "--repeat", "1", "--save", str(saved)])
+    
+    mb.main()
+    
+    results = json.loads(saved.read_text(encoding="utf-8"))
+    assert set(results) == {"300", "300 bundled", "300 listed", "300 hash", "300 hash bundled", "300 hash listed"}
+    assert "scan_bundles" in results["300 hash bundled"]
+    assert "verify_completeness" in results["300 hash listed"]
+
+
+def test_bundled_items_are_not_reported_missing():
+    base = mb.build_dataset(300, "hash", bundle=True)
+    mb.point_scripts_at(base, "hash")
+    
+    bundled = vr.scan_bundles()
+    result = vr.verify_completeness(vr.load_manifest(), vr.scan_disk_files(), bundled)
+    
+    assert bundled
+    assert not {row["media_id"] for row in result["missing"]} & bundled.keys()
+    assert all(len(rel.split("/")) == 3 for rel in result["unexpected"])  # <year>/<hash>/<file>
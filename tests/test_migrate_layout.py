@@ -0,0 +1,89 @@
+# tests/test_migrate_layout.py
+"""
+After a layout migration, memories_verify_recover.py must find every file
+where the manifest says it is: nothing missing, nothing unexpected.
+Run with: python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import memories_download as md
+import memories_migrate_layout as mm
+import memories_verify_recover as vr
+
+# Module-level paths that md.activate_export() repoints
+EXPORT_PATHS = ["BASE_DIR", "TEMP_DIR", "LOG_DIR", "HTML_FILE", "MANIFEST_CSV", "MANIFEST_BIN", "DOWNLOAD_LOG_CSV",
+                "ERRORS_LOG", "SUMMARY_TXT", "INDEX_FILE", "CHECKSUM_MANIFEST", "PROFILE_FOLDED", "PROFILE_REPORT"]
+
+
+@pytest.fixture(autouse=True)
+def restore_export_paths(monkeypatch):
+    """Put md's path settings back after each test (monkeypatch undoes these on teardown)"""
+    for name in EXPORT_PATHS:
+        monkeypatch.setattr(md, name, getattr(md, name))
+
+
+def make_library(base_dir, count=5):
+    """An export folder with its HTML, manifest and files in the "year" layout"""
+    rows = "".join(
+        f"<tr><td>2019-06-0{i + 1} 12:00:00 UTC</td><td>Image</td><td></td>"
+        f"<td><a onclick=\"downloadMemories('https://example.com/dl?mid=m{i}&x=1')\">d</a></td></tr>"
+        for i in range(count)
+    )
+    (base_dir / "memories_history.html").write_text(f"<table>{rows}</table>", encoding="utf-8")
+    
+    md.activate_export(base_dir)
+    md.setup_directories()
+    items = md.parse_html_and_dedupe(md.HTML_FILE)
+    md.create_manifest(items)
+    for item in items:
+        path = base_dir / str(item["year"]) / f"{item['timestamp'].strftime('%Y-%m-%d_%H%M%S')}_{item['media_id']}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"\xff\xd8" + bytes(2048) + b"\xff\xd9")
+    return items
+
+
+def point_at(monkeypatch, base_dir, layout):
+    """Aim the migration and verify scripts (which import paths by value) at base_dir"""
+    monkeypatch.setattr(md, "LIBRARY_LAYOUT", layout)
+    for name, value in [("BASE_DIR", md.BASE_DIR), ("LIBRARY_LAYOUT", layout),
+                        ("CHECKSUM_MANIFEST", md.CHECKSUM_MANIFEST), ("MANIFEST_CSV", md.MANIFEST_CSV)]:
+        monkeypatch.setattr(mm, name, value)
+    for name, value in [("BASE_DIR", md.BASE_DIR), ("LOG_DIR", md.LOG_DIR),
+                        ("MANIFEST_CSV", md.MANIFEST_CSV), ("MANIFEST_BIN", md.MANIFEST_BIN)]:
+        monkeypatch.setattr(vr, name, value)
+
+
+def test_nothing_missing_after_migration(tmp_path, monkeypatch):
+    items = make_library(tmp_path)
+    point_at(monkeypatch, tmp_path, "day")
+    
+    mm.main()
+    
+    assert not list((tmp_path / "2019").glob("*.jpg"))  # every file moved into a day folder
+    result = vr.verify_completeness(vr.load_manifest(), vr.scan_disk_files())
+    assert len(result["missing"]) == 0
+    assert len(result["unexpected"]) == 0
+    assert result["verified"] == len(items)
+
+
+def test_migration_works_without_the_html_file(tmp_path, monkeypatch):
+    items = make_library(tmp_path)
+    md.HTML_FILE.unlink()
+    point_at(monkeypatch, tmp_path, "hash")
+    
+    mm.main()
+    
+    result = vr.verify_completeness(vr.load_manifest(), vr.scan_disk_files())
+    assert len(result["missing"]) == 0
+    assert len(result["unexpected"]) == 0
+    assert result["verified"] == len(items)
+    
+    # The search index is rebuilt from the manifest rows, so it follows the new layout too
+    names = md.load_index()["names"]
+    assert len(names) == len(items)
+    assert all((tmp_path / f"{name}.jpg").exists() for name in names)
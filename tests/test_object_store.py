@@ -0,0 +1,85 @@
+# tests/test_object_store.py
+"""
+ObjectStore against a mocked S3 (moto): one-request and multipart uploads
+carry the file's SHA-256 as metadata, and a rerun skips what is already
+in the bucket.
+Run with: python -m pytest tests   (needs boto3 and moto; skipped otherwise)
+"""
+import asyncio
+import hashlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+import memories_download as md
+
+BUCKET = "memories-test"
+CAPTURE_TIME = 1559390400  # 2019-06-01 12:00:00 UTC
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh ObjectStore aimed at an empty mocked bucket, with 5 MB parts (the S3 minimum)"""
+    for name, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(name, value)
+    
+    with moto.mock_aws():
+        store = md.ObjectStore()
+        monkeypatch.setattr(md, "object_store", store)
+        monkeypatch.setattr(md, "S3_BUCKET", BUCKET)
+        monkeypatch.setattr(md, "S3_PREFIX", "")
+        monkeypatch.setattr(md, "S3_ENDPOINT_URL", None)
+        monkeypatch.setattr(md, "S3_PART_SIZE_MB", 5)
+        monkeypatch.setattr(md, "BASE_DIR", tmp_path)
+        store.client.create_bucket(Bucket=BUCKET)
+        yield store
+        if store.executor:
+            store.executor.shutdown()
+
+
+def upload(store, rel, chunks):
+    return asyncio.run(store.upload(md.BASE_DIR, md.BASE_DIR / rel, chunks, CAPTURE_TIME))
+
+
+def test_single_upload_records_sha256(store):
+    chunks = [b"\xff\xd8\xff", b"x" * 1000, b"\xff\xd9"]
+    
+    digest = upload(store, "2019/2019-06-01_120000_ABC.jpg", chunks)
+    
+    key = f"{md.BASE_DIR.name}/2019/2019-06-01_120000_ABC.jpg"
+    head = store.client.head_object(Bucket=BUCKET, Key=key)
+    assert digest == hashlib.sha256(b"".join(chunks)).hexdigest()
+    assert head["Metadata"]["sha256"] == digest
+    assert head["Metadata"]["capture-time"] == "2019-06-01T12:00:00+00:00"
+    assert "-" not in head["ETag"]  # one PutObject, no multipart
+
+
+def test_multipart_upload_from_chunks(store):
+    # Uneven chunks, so ChunkReader has to split and join them across 5 MB part boundaries
+    chunks = [bytes([i]) * (3 * 1024 * 1024 + 17) for i in range(4)]
+    
+    digest = upload(store, "2019/2019-06-01_120000_VID.mp4", chunks)
+    
+    key = f"{md.BASE_DIR.name}/2019/2019-06-01_120000_VID.mp4"
+    obj = store.client.get_object(Bucket=BUCKET, Key=key)
+    assert obj["ETag"].strip('"').endswith("-3")  # 12 MB in 5 MB parts
+    assert obj["Metadata"]["sha256"] == digest == hashlib.sha256(b"".join(chunks)).hexdigest()
+    assert obj["Body"].read() == b"".join(chunks)
+
+
+def test_rerun_skips_uploaded_items(store):
+    items = [md.MemoryItem("https://example.com/dl?mid=A", CAPTURE_TIME, "", "A", "Image"),
+             md.MemoryItem("https://example.com/dl?mid=B", CAPTURE_TIME + 60, "", "B", "Image")]
+    upload(store, f"{md.media_subdir(items[0]['timestamp'], 'A')}/2019-06-01_120000_A.jpg", [b"jpeg"])
+    
+    to_download = md.check_existing_files(items)
+    
+    assert [item["media_id"] for item in to_download] == ["B"]
+    assert store.list_files(md.BASE_DIR) == {"2019/2019-06-01_120000_A.jpg": 4}
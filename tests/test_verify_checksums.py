@@ -0,0 +1,68 @@
+# tests/test_verify_checksums.py
+"""
+A file corrupted in place, with its mtime put back the way the downloader
+sets it, must still fail checksum verification.
+Run with: python -m pytest tests
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import memories_download as md
+import memories_verify_recover as vr
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """A few checksummed files, with the verify script pointed at them"""
+    logs = tmp_path / "_logs"
+    logs.mkdir()
+    for name, value in [("BASE_DIR", tmp_path), ("CHECKSUM_MANIFEST", logs / "manifest-sha256.txt"),
+                        ("CHECKSUM_STATE", logs / "state.json"), ("CHECKSUM_MISMATCHES_CSV", logs / "mismatches.csv")]:
+        monkeypatch.setattr(vr, name, value)
+    monkeypatch.setattr(sys, "argv", ["memories_verify_recover.py"])
+    
+    files = []
+    for i in range(3):
+        path = tmp_path / "2019" / f"2019-06-0{i + 1}_120000_m{i}.jpg"
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(bytes(range(256)) * 64)
+        os.utime(path, (1559390400, 1559390400))  # capture time, as the downloader sets it
+        md.append_checksum(vr.CHECKSUM_MANIFEST, path.relative_to(tmp_path).as_posix(), md.file_sha256(path))
+        files.append(path)
+    return files
+
+
+def corrupt_in_place(path):
+    """Flip one byte and put size and mtime back, like silent corruption would leave them"""
+    st = path.stat()
+    data = bytearray(path.read_bytes())
+    data[len(data) // 2] ^= 0x01
+    path.write_bytes(bytes(data))
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def test_default_verify_catches_in_place_corruption(library):
+    assert vr.verify_checksums()["mismatched"] == []
+    
+    corrupt_in_place(library[1])
+    result = vr.verify_checksums()
+    
+    assert [rel for rel, _, _ in result["mismatched"]] == ["2019/2019-06-02_120000_m1.jpg"]
+    assert result["unchanged"] == 0
+
+
+def test_only_changed_still_catches_rewritten_file(library, monkeypatch):
+    monkeypatch.setattr(vr, "CHECKSUM_ONLY_CHANGED", True)
+    assert vr.verify_checksums()["hashed"] == 3
+    assert vr.verify_checksums()["unchanged"] == 3
+    
+    corrupt_in_place(library[0])
+    result = vr.verify_checksums()
+    
+    assert [rel for rel, _, _ in result["mismatched"]] == ["2019/2019-06-01_120000_m0.jpg"]
+    assert result["unchanged"] == 2